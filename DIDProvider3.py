@@ -1,166 +1,1377 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import uuid
-import json
 import os
 import base64
+import atexit
+import hashlib
+import json
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Librerías de criptografía
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from did_cache import BloomFilter, IdempotencyCache, LRUCache
+from did_crypto import (DEFAULT_KEY_TYPE, KEY_TYPES, ClientKeyValidator, PublicKeyCache,
+                        verify_many, verify_signature)
+from did_key import did_from_pem, resolve_did_key
+from did_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from did_patch import PatchError, apply_patch, invalid_patch, make_patch, updates_to_patch
+from did_records import pem_cache_stats
+from did_replica import Follower
+from did_storage import (INDEXED_FIELDS, ReplicaStore, SQLiteIdempotencyCache, UpdateConflict,
+                         open_store)
+from did_versions import (current_version, effective_time, last_updated, metadata, now_ms,
+                          parse_time, rebuild, record_update)
+from key_pool import KeyPairPool
 
 app = Flask(__name__)
 
 # Ruta para almacenar el registro de DIDs
 DID_REGISTRY_FILE = 'did_registry.json'
 
+# Modo de almacenamiento: 'json' (archivo completo), 'log' (snapshot + log)
+# o 'sqlite'
+DID_STORAGE = os.environ.get('DID_STORAGE', 'json')
+DID_LOG_FILE = os.environ.get('DID_LOG_FILE')
+DID_SNAPSHOT_FILE = os.environ.get('DID_SNAPSHOT_FILE')
+DID_SQLITE_FILE = os.environ.get('DID_SQLITE_FILE')
+# Conexiones de lectura del modo 'sqlite', compartidas por los hilos
+DID_SQLITE_READERS = int(os.environ.get('DID_SQLITE_READERS', '8'))
+DID_VERSIONS_FILE = os.environ.get('DID_VERSIONS_FILE')
+DID_LOG_COMPACT_THRESHOLD = int(os.environ.get('DID_LOG_COMPACT_THRESHOLD', '10000'))
+
+# Arranque lazy del modo 'log': índice de offsets + caché LRU de entradas
+DID_LAZY_LOAD = os.environ.get('DID_LAZY_LOAD', '0') == '1'
+DID_ENTRY_CACHE_SIZE = int(os.environ.get('DID_ENTRY_CACHE_SIZE', '10000'))
+
+# Durabilidad de las escrituras: 'fsync', 'group' o 'buffered'
+DID_DURABILITY = os.environ.get('DID_DURABILITY', 'buffered')
+DID_GROUP_COMMIT_MS = float(os.environ.get('DID_GROUP_COMMIT_MS', '5'))
+
+# Cambios recientes que se conservan para /changes
+DID_CHANGES_RETENTION = int(os.environ.get('DID_CHANGES_RETENTION', '100000'))
+
+# Cada cuántas versiones el historial de un DID guarda el documento
+# completo en lugar de un delta; acota los deltas a aplicar por consulta
+DID_VERSION_CHECKPOINT_INTERVAL = int(os.environ.get('DID_VERSION_CHECKPOINT_INTERVAL', '10'))
+if DID_VERSION_CHECKPOINT_INTERVAL < 1:
+    raise ValueError(f'DID_VERSION_CHECKPOINT_INTERVAL must be at least 1, '
+                     f'got {DID_VERSION_CHECKPOINT_INTERVAL}')
+
+# Forma de los DIDs nuevos: 'uuid' (did:key:<uuid4>) o 'derived'
+# (did:key:z... derivado de la clave pública; el registro guarda solo los
+# metadatos y el documento base se reconstruye desde el identificador)
+DID_KEY_MODE = os.environ.get('DID_KEY_MODE', 'uuid')
+if DID_KEY_MODE not in ('uuid', 'derived'):
+    raise ValueError(f'Unknown DID_KEY_MODE {DID_KEY_MODE!r}')
+
+# Modo seguidor: URL del primario cuyo registro se replica en memoria.
+# El seguidor sirve las lecturas, rechaza las escrituras con 403 y espera
+# a haber aplicado `minSeq` (como mucho DID_MIN_SEQ_WAIT segundos) en las
+# peticiones que lo piden. DID_FOLLOW_TIMEOUT es el tiempo sin noticias
+# del primario tras el que se reconecta.
+DID_FOLLOW = os.environ.get('DID_FOLLOW')
+DID_FOLLOW_TIMEOUT = float(os.environ.get('DID_FOLLOW_TIMEOUT', '60'))
+DID_MIN_SEQ_WAIT = float(os.environ.get('DID_MIN_SEQ_WAIT', '5'))
+
 # Cargar el registro si existe o inicializar uno nuevo
-if os.path.exists(DID_REGISTRY_FILE):
-    with open(DID_REGISTRY_FILE, 'r') as f:
-        did_registry = json.load(f)
+if DID_FOLLOW:
+    registry_store = ReplicaStore(DID_CHANGES_RETENTION)
 else:
-    did_registry = {}
+    registry_store = open_store(DID_STORAGE, DID_REGISTRY_FILE,
+                                log_file=DID_LOG_FILE,
+                                snapshot_file=DID_SNAPSHOT_FILE,
+                                compact_threshold=DID_LOG_COMPACT_THRESHOLD,
+                                durability=DID_DURABILITY,
+                                group_commit_ms=DID_GROUP_COMMIT_MS,
+                                sqlite_file=DID_SQLITE_FILE,
+                                sqlite_readers=DID_SQLITE_READERS,
+                                lazy=DID_LAZY_LOAD,
+                                cache_size=DID_ENTRY_CACHE_SIZE,
+                                changes_retention=DID_CHANGES_RETENTION,
+                                versions_file=DID_VERSIONS_FILE)
+atexit.register(registry_store.close)
 
-def save_registry():
-    with open(DID_REGISTRY_FILE, 'w') as f:
-        json.dump(did_registry, f, indent=4)
+# Pool de pares de claves pre-generados por procesos de fondo
+KEY_POOL_LOW_WATERMARK = int(os.environ.get('DID_KEY_POOL_LOW', '4'))
+KEY_POOL_HIGH_WATERMARK = int(os.environ.get('DID_KEY_POOL_HIGH', '16'))
+KEY_POOL_WORKERS = int(os.environ.get('DID_KEY_POOL_WORKERS', '0')) or None
 
-def generate_did():
-    return f"did:key:{uuid.uuid4()}"
+key_pool = KeyPairPool(KEY_POOL_LOW_WATERMARK, KEY_POOL_HIGH_WATERMARK,
+                       KEY_POOL_WORKERS)
+atexit.register(key_pool.shutdown)
+
+# Claves públicas ya cargadas para verificar firmas en /UpdateDID
+DID_KEY_CACHE_SIZE = int(os.environ.get('DID_KEY_CACHE_SIZE', '10000'))
+public_key_cache = PublicKeyCache(DID_KEY_CACHE_SIZE)
+
+# Claves públicas aportadas por el cliente en /CreateDID ya validadas,
+# por huella de la clave recibida
+DID_CLIENT_KEY_CACHE_SIZE = int(os.environ.get('DID_CLIENT_KEY_CACHE_SIZE', '10000'))
+client_key_validator = ClientKeyValidator(DID_CLIENT_KEY_CACHE_SIZE)
+
+# Respuestas de /CreateDID por Idempotency-Key: cuántas se guardan,
+# durante cuántos segundos y cuánto espera un reintento a que termine la
+# petición original con la misma clave
+DID_IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('DID_IDEMPOTENCY_CACHE_SIZE', '10000'))
+DID_IDEMPOTENCY_TTL = float(os.environ.get('DID_IDEMPOTENCY_TTL', '86400'))
+DID_IDEMPOTENCY_WAIT = float(os.environ.get('DID_IDEMPOTENCY_WAIT', '30'))
+# Con `serve --workers N` las claves se reservan en la base SQLite
+# compartida; una reserva cuyo worker murió caduca a los
+# DID_IDEMPOTENCY_LEASE segundos
+DID_IDEMPOTENCY_LEASE = float(os.environ.get('DID_IDEMPOTENCY_LEASE', '300'))
+idempotency_cache = IdempotencyCache(DID_IDEMPOTENCY_CACHE_SIZE, DID_IDEMPOTENCY_TTL)
+
+# Máximo de DIDs por petición a /CreateDIDBatch
+DID_BATCH_MAX_SIZE = int(os.environ.get('DID_BATCH_MAX_SIZE', '1000'))
+
+# Máximo de DIDs por petición a /VerifyDIDBatch y /DIDRegistryGetBatch
+DID_LOOKUP_BATCH_MAX_SIZE = int(os.environ.get('DID_LOOKUP_BATCH_MAX_SIZE', '1000'))
 
-def generate_key_pair():
+# Tamaño de página de /DIDs: por defecto y máximo que admite `limit`
+DID_LIST_DEFAULT_LIMIT = int(os.environ.get('DID_LIST_DEFAULT_LIMIT', '100'))
+DID_LIST_MAX_LIMIT = int(os.environ.get('DID_LIST_MAX_LIMIT', '1000'))
+
+# /changes: máximo de cambios por respuesta, espera máxima de un long-poll
+# y cada cuántos segundos sin cambios se envía un keep-alive por SSE
+DID_CHANGES_MAX_LIMIT = int(os.environ.get('DID_CHANGES_MAX_LIMIT', '1000'))
+DID_CHANGES_MAX_WAIT = float(os.environ.get('DID_CHANGES_MAX_WAIT', '30'))
+DID_CHANGES_HEARTBEAT = float(os.environ.get('DID_CHANGES_HEARTBEAT', '15'))
+
+# Verificación de firmas en lote (/VerifySignatures): hilos que verifican
+# en paralelo y máximo de firmas por petición
+DID_VERIFY_THREADS = int(os.environ.get('DID_VERIFY_THREADS', '0')) or os.cpu_count() or 1
+DID_VERIFY_BATCH_MAX_SIZE = int(os.environ.get('DID_VERIFY_BATCH_MAX_SIZE', '10000'))
+verify_executor = ThreadPoolExecutor(DID_VERIFY_THREADS, thread_name_prefix='did-verify')
+atexit.register(verify_executor.shutdown)
+
+# Respuestas de /DIDRegistryGet ya codificadas, con su ETag, por DID
+DID_RESPONSE_CACHE_SIZE = int(os.environ.get('DID_RESPONSE_CACHE_SIZE', '10000'))
+response_cache = LRUCache(DID_RESPONSE_CACHE_SIZE)
+# Generación de los DIDs, por franjas: cada escritura o invalidación la
+# incrementa, y una lectura solo guarda su respuesta en la caché si la
+# generación no cambió desde que leyó la entrada
+CACHE_GENERATION_STRIPES = 1024
+cache_generations = [0] * CACHE_GENERATION_STRIPES
+cache_generation_lock = threading.Lock()
+
+def cache_generation(did):
+    return cache_generations[hash(did) % CACHE_GENERATION_STRIPES]
+
+def invalidate_document(did):
+    """Olvida la respuesta cacheada de `did` y las lecturas en curso."""
+    with cache_generation_lock:
+        cache_generations[hash(did) % CACHE_GENERATION_STRIPES] += 1
+        response_cache.pop(did)
+
+# Cache-Control de /DIDRegistryGet; con 0 los clientes revalidan siempre
+DID_CACHE_MAX_AGE = int(os.environ.get('DID_CACHE_MAX_AGE', '60'))
+# Las versiones anteriores de un documento ya no cambian
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Filtro de Bloom sobre los DIDs registrados: los DIDs que seguro no
+# existen se responden con 404 sin consultar el almacenamiento
+DID_BLOOM_FP_RATE = float(os.environ.get('DID_BLOOM_FP_RATE', '0.01'))
+DID_BLOOM_MIN_CAPACITY = int(os.environ.get('DID_BLOOM_MIN_CAPACITY', '10000'))
+
+def build_did_filter():
+    dids = list(registry_store.iter_dids())
+    did_filter = BloomFilter(max(2 * len(dids), DID_BLOOM_MIN_CAPACITY), DID_BLOOM_FP_RATE)
+    for did in dids:
+        did_filter.add(did)
+    return did_filter
+
+did_filter = build_did_filter()
+lookup_stats = {'filter_rejects': 0, 'storage_hits': 0, 'storage_misses': 0}
+
+# Modo `serve` con varios procesos: cada worker aplica los cambios hechos
+# por los demás (tabla did_changes de SQLite) como mucho cada
+# DID_SYNC_INTERVAL_MS, antes de atender la siguiente petición
+DID_SYNC_INTERVAL_MS = float(os.environ.get('DID_SYNC_INTERVAL_MS', '100'))
+change_sync = {'cursor': None, 'checked': 0.0, 'applied': 0, 'resyncs': 0}
+change_sync_lock = threading.Lock()
+
+def sync_changes():
     """
-    Genera un par de claves RSA (2048 bits) y devuelve
-    la clave pública y la clave privada en formato PEM.
+    Invalida las cachés de los DIDs que otros procesos crearon o
+    modificaron y agrega los nuevos al filtro de Bloom. No hace nada fuera
+    del modo multiproceso (cursor None).
     """
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048
-    )
-    public_key = private_key.public_key()
+    if change_sync['cursor'] is None:
+        return
+    interval = DID_SYNC_INTERVAL_MS / 1000.0
+    if time.monotonic() - change_sync['checked'] < interval:
+        return
+    with change_sync_lock:
+        if time.monotonic() - change_sync['checked'] < interval:
+            return
+        changes = registry_store.changes_since(change_sync['cursor'])
+        if changes is None:
+            # Los cambios pendientes ya se recortaron: se descarta todo
+            cursor = registry_store.last_change()
+            reset_caches(registry_store.iter_dids())
+            change_sync['resyncs'] += 1
+        else:
+            cursor = changes[-1][0] if changes else change_sync['cursor']
+            for _, did in changes:
+                invalidate_did(did)
+            change_sync['applied'] += len(changes)
+        change_sync['cursor'] = cursor
+        change_sync['checked'] = time.monotonic()
 
-    private_pem = private_key.private_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,
-        encryption_algorithm=serialization.NoEncryption()
-    ).decode('utf-8')
+def invalidate_did(did):
+    """Olvida lo cacheado de un DID que cambió fuera de este proceso."""
+    invalidate_document(did)
+    public_key_cache.invalidate(did)
+    if did not in did_filter:
+        did_filter.add(did)
 
-    public_pem = public_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    ).decode('utf-8')
+def reset_caches(dids):
+    """
+    Vacía la caché de respuestas y agrega `dids` al filtro de Bloom. La
+    caché de claves se revalida sola contra el PEM registrado.
+    """
+    with cache_generation_lock:
+        for stripe in range(CACHE_GENERATION_STRIPES):
+            cache_generations[stripe] += 1
+        response_cache.clear()
+    for did in dids:
+        if did not in did_filter:
+            did_filter.add(did)
 
-    return public_pem, private_pem
+follower = None
+if DID_FOLLOW:
+    follower = Follower(DID_FOLLOW, registry_store, on_bootstrap=reset_caches,
+                        on_change=invalidate_did, timeout=DID_FOLLOW_TIMEOUT)
 
-@app.route('/CreateDID', methods=['POST'])
-def create_did():
+def start_background():
+    """Arranca el pool de claves o, en modo seguidor, la replicación."""
+    if follower is not None:
+        follower.start()
+    else:
+        key_pool.start()
+
+def split_key_pool(workers):
     """
-    Crea un DID, genera un par de claves RSA y
-    almacena solo la clave pública en el servidor.
+    Reparte el pool de claves entre los `workers` procesos de `serve`:
+    cada uno arranca el suyo tras el fork, así que sus marcas y procesos
+    generadores son la parte que le toca de los totales configurados.
     """
-    data = request.json
+    key_pool.workers = max(1, (KEY_POOL_WORKERS or os.cpu_count() or 1) // workers)
+    key_pool.high_watermark = -(-KEY_POOL_HIGH_WATERMARK // workers)
+    key_pool.low_watermark = min(-(-KEY_POOL_LOW_WATERMARK // workers), key_pool.high_watermark)
 
-    # Validar que se proporcionen los datos básicos
-    required_fields = ['entity', 'name', 'purpose']
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
+def stop_background():
+    if follower is not None:
+        follower.stop()
+    else:
+        key_pool.shutdown()
+
+# Métricas de Prometheus en /metrics; con 0 no se registra nada
+DID_METRICS = os.environ.get('DID_METRICS', '1') == '1'
+metrics = Metrics(enabled=DID_METRICS)
+metrics.register_stats('key_pool', key_pool.stats, 'Pre-generated key pair pool')
+metrics.register_stats('commit', registry_store.commit_stats, 'Registry commits')
+metrics.register_stats('response_cache', response_cache.stats, 'Encoded document cache')
+metrics.register_stats('key_cache', public_key_cache.stats, 'Loaded public key cache')
+metrics.register_stats('client_key_cache', client_key_validator.stats,
+                       'Client-supplied key validation cache')
+metrics.register_stats('pem_cache', pem_cache_stats, 'Record format PEM cache')
+metrics.register_stats('idempotency', lambda: idempotency_cache.stats(),
+                       'CreateDID idempotency key cache')
+metrics.register_stats('bloom', did_filter.stats, 'Bloom filter over registered DIDs')
+metrics.register_stats('lookups', lambda: lookup_stats, 'DID lookups')
+metrics.register_stats('sync', lambda: {key: change_sync[key] for key in ('applied', 'resyncs')},
+                       'Changes applied from other serve workers')
+if hasattr(registry_store, 'cache_stats'):
+    metrics.register_stats('entry_cache', registry_store.cache_stats, 'Lazy mode entry cache')
+if hasattr(registry_store, 'index_stats'):
+    metrics.register_stats('index', registry_store.index_stats, 'In-memory secondary indexes')
+if follower is not None:
+    metrics.register_stats('replication', follower.status, 'Follower replication state')
+
+# Rutas que modifican el registro; un seguidor las rechaza
+WRITE_ENDPOINTS = {'create_did', 'create_did_batch', 'update_did'}
+
+@app.before_request
+def before_request():
+    g.request_start = time.perf_counter()
+    if follower is not None and request.endpoint in WRITE_ENDPOINTS:
+        return jsonify(read_only_error()[0]), 403
+    sync_changes()
+    if 'minSeq' in request.args:
+        error = wait_for_seq(request.args['minSeq'])
+        if error:
+            return jsonify(error[0]), error[1], {'Retry-After': '1'}
+
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - start)
+    if follower is not None and 'X-DID-Seq' not in response.headers:
+        response.headers['X-DID-Seq'] = str(registry_store.last_change())
+    return response
+
+def read_only_error():
+    return {"error": "This server is a read-only replica", "primary": DID_FOLLOW}, 403
+
+def wait_for_seq(value):
+    """
+    Espera, como mucho DID_MIN_SEQ_WAIT, a que el registro incluya el
+    cambio `value` (lectura de las propias escrituras en un seguidor).
+    Devuelve None o `(cuerpo de error, estado)`.
+    """
+    try:
+        min_seq = int(value)
+    except ValueError:
+        return {"error": "minSeq must be a sequence number"}, 400
+    deadline = time.monotonic() + DID_MIN_SEQ_WAIT
+    while True:
+        seq = registry_store.last_change()
+        remaining = deadline - time.monotonic()
+        if seq >= min_seq:
+            return None
+        if remaining <= 0:
+            return {"error": "minSeq not reached yet", "seq": seq, "minSeq": min_seq}, 503
+        registry_store.wait_for_change(seq, remaining)
+
+def seq_headers(seq):
+    """Cabecera con el número de secuencia de una escritura."""
+    return {'X-DID-Seq': str(seq)} if seq is not None else {}
+
+REQUIRED_CREATE_FIELDS = ['entity', 'name', 'purpose']
+
+# Las actualizaciones de un mismo DID (leer la entrada, aplicar el parche
+# y guardarla) se serializan con un lock por franja de DIDs
+UPDATE_LOCK_STRIPES = 1024
+update_locks = [threading.Lock() for _ in range(UPDATE_LOCK_STRIPES)]
+
+def save_registry(did, entry, previous=None, versions=()):
+    """
+    Persiste la entrada de un DID según el modo de almacenamiento y
+    devuelve el número de secuencia del cambio. Si `previous` es la
+    entrada guardada que se reemplaza, el almacén recibe además el JSON
+    Patch entre ambas para persistir solo lo que cambió, y los registros
+    `versions` que la actualización añade al historial.
+    """
+    stored = metadata_entry(did, entry)
+    with metrics.stage('persist'):
+        if previous is None:
+            seq = registry_store.put(did, stored)
+        else:
+            seq = registry_store.update(did, stored, make_patch(previous, stored), versions)
+    invalidate_document(did)
+    return seq
+
+def base_document(did, public_pem, key_type):
+    return {"id": did, "keyType": key_type, "publicKey": public_pem}
+
+def metadata_entry(did, entry):
+    """
+    Entrada tal como se guarda en el registro. Para un did:key derivado se
+    quitan la clave y los campos del documento que coinciden con el
+    documento base, que se reconstruye desde el identificador.
+    """
+    derived = resolve_did_key(did)
+    if derived is None:
+        return entry
+    base = base_document(did, *derived)
+    stored = {key: value for key, value in entry.items()
+              if key not in ('did_document', 'public_key')}
+    stored['did_document'] = {key: value for key, value in entry['did_document'].items()
+                              if base.get(key, base) != value}
+    return stored
+
+def removed_base_fields(did, did_document):
+    """
+    Campos del documento base de un did:key derivado que faltan en
+    `did_document`. No se pueden quitar: el documento base se reconstruye
+    desde el identificador y volverían a aparecer.
+    """
+    derived = resolve_did_key(did)
+    if derived is None:
+        return []
+    return [key for key in base_document(did, *derived) if key not in did_document]
+
+def expand_entry(did, entry):
+    """
+    Completa la entrada de un did:key derivado con su documento base; si
+    `entry` es None devuelve solo el documento base. Los DIDs UUID se
+    devuelven tal cual.
+    """
+    derived = resolve_did_key(did)
+    if derived is None:
+        return entry
+    public_pem, key_type = derived
+    did_document = {"id": did}
+    did_document.update(entry['did_document'] if entry is not None else {})
+    did_document.setdefault("keyType", key_type)
+    did_document.setdefault("publicKey", public_pem)
+    return dict(entry or {}, did_document=did_document, public_key=public_pem)
 
-    # Generar el DID y el par de claves RSA
-    did = generate_did()
-    public_pem, private_pem = generate_key_pair()
+def lookup_entry(did):
+    """Entrada del DID o None, consultando primero el filtro de Bloom."""
+    if not did or did not in did_filter:
+        lookup_stats['filter_rejects'] += 1
+        return None
+    entry = registry_store.get(did)
+    lookup_stats['storage_hits' if entry is not None else 'storage_misses'] += 1
+    return expand_entry(did, entry) if entry is not None else None
 
-    did_document = {
+def filter_dids(dids):
+    """Separa los DIDs que el filtro descarta de los que hay que consultar."""
+    candidates = [did for did in dids if did in did_filter]
+    lookup_stats['filter_rejects'] += len(dids) - len(candidates)
+    return candidates
+
+def record_storage_lookups(candidates, found):
+    lookup_stats['storage_hits'] += found
+    lookup_stats['storage_misses'] += candidates - found
+
+def encode_document(entry, version=None, records=None):
+    """
+    Codifica el documento de un DID tal como lo devuelve la API, junto con
+    un ETag fuerte derivado del contenido: la versión actual, o la versión
+    anterior `version` reconstruida con sus `records` del historial.
+    """
+    if version is None:
+        document, meta = entry['did_document'], metadata(entry)
+    else:
+        document = rebuild(records, entry.get('public_key'))
+        meta = metadata(entry, version, records[-1]['t'])
+    body = json.dumps({
+        "DID_Document": document,
+        "PublicKey": entry["public_key"],
+        "DIDDocumentMetadata": meta
+    }, separators=(',', ':')).encode('utf-8')
+    return body, hashlib.sha256(body).hexdigest()[:32]
+
+def cache_document(did, entry, generation):
+    """
+    Codifica la entrada y la guarda en la caché si el DID no cambió desde
+    `generation` (cache_generation antes de leer la entrada).
+    """
+    encoded = encode_document(entry)
+    with cache_generation_lock:
+        if cache_generation(did) == generation:
+            response_cache.put(did, encoded)
+    return encoded
+
+def resolve_public_keys(dids):
+    """
+    Clave pública ya cargada de cada DID que se puede resolver, leyendo el
+    almacenamiento una sola vez para todos.
+    """
+    candidates = filter_dids(dids)
+    entries = registry_store.get_many(candidates) if candidates else {}
+    record_storage_lookups(len(candidates), len(entries))
+    keys = {}
+    for did in dids:
+        entry = expand_entry(did, entries.get(did))
+        if entry is None or not entry.get('public_key'):
+            continue
+        try:
+            with metrics.stage('key_load'):
+                keys[did] = public_key_cache.load(did, entry['public_key'])
+        except ValueError:
+            pass
+    return keys
+
+def requested_dids():
+    """Lista de DIDs del cuerpo `{"dids": [...]}` o un error 400/413."""
+    data = request.get_json(silent=True)
+    dids = data.get('dids') if isinstance(data, dict) else None
+    if not isinstance(dids, list) or not all(isinstance(did, str) for did in dids):
+        return None, (jsonify({"error": "Expected {\"dids\": [...]}"}), 400)
+    if len(dids) > DID_LOOKUP_BATCH_MAX_SIZE:
+        return None, (jsonify({"error": f"Batch too large (max {DID_LOOKUP_BATCH_MAX_SIZE})"}), 413)
+    # Sin duplicados y conservando el orden de la petición
+    return list(dict.fromkeys(dids)), None
+
+def generate_did(public_pem):
+    if DID_KEY_MODE == 'derived':
+        return did_from_pem(public_pem)
+    return f"did:key:{uuid.uuid4()}"
+
+def registered_did(did):
+    return did in did_filter and registry_store.exists(did)
+
+def new_did_document(did, data, public_pem, key_type):
+    return {
         "id": did,
         "controller": data['entity'],
         "name": data['name'],
         "purpose": data['purpose'],
+        "keyType": key_type,
         "publicKey": public_pem
     }
 
-    # Almacenar solo la clave pública
-    did_registry[did] = {
-        "did_document": did_document,
-        "public_key": public_pem
-    }
+def invalid_create_request(data):
+    """Mensaje de error si los datos de creación no son válidos, o None."""
+    if not isinstance(data, dict) or not all(field in data for field in REQUIRED_CREATE_FIELDS):
+        return "Missing required fields"
+    if data.get('keyType', DEFAULT_KEY_TYPE) not in KEY_TYPES:
+        return f"Unsupported keyType (expected one of {', '.join(KEY_TYPES)})"
+    if 'publicKey' in data:
+        try:
+            _, key_type = client_key_validator.validate(data['publicKey'])
+        except ValueError as e:
+            return str(e)
+        if data.get('keyType', key_type) != key_type:
+            return f"keyType does not match publicKey ({key_type})"
+    return None
 
-    save_registry()
+def client_key(data):
+    """
+    `(public_pem, key_type)` de la clave aportada por el cliente, o None si
+    el servidor debe generar el par. La validación ya se hizo en
+    invalid_create_request, así que aquí es un acierto de la caché.
+    """
+    if 'publicKey' not in data:
+        return None
+    return client_key_validator.validate(data['publicKey'])
 
-    return jsonify({
+def created_response(did, did_document, public_pem, private_pem):
+    response = {
         "DID": did,
         "DID_Document": did_document,
-        "PublicKey": public_pem,
-        "PrivateKey": private_pem  # Se envía al usuario, pero NO se almacena en el servidor
-    }), 201
+        "PublicKey": public_pem
+    }
+    # La clave privada se envía al usuario, pero NO se almacena en el servidor
+    if private_pem is not None:
+        response["PrivateKey"] = private_pem
+    return response
+
+# Lógica de las rutas sin dependencias de Flask: cada función devuelve el
+# cuerpo y el código de estado, y la comparten la app Flask y did_asgi.
+
+def claim_idempotency_key(key, data):
+    """
+    Reserva `key` para una petición de /CreateDID con el cuerpo `data`.
+    Devuelve `(slot, None)` si esta petición debe crear el DID y cerrar
+    luego el slot con finish_idempotent, o `(None, (cuerpo, estado,
+    cabeceras))` con la respuesta original o un error. Si la petición
+    original sigue en curso, espera a que termine en lugar de generar
+    otro par de claves.
+    """
+    if not key or len(key) > 255:
+        return None, ({"error": "Invalid Idempotency-Key"}, 400, {})
+    fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':'))
+                                 .encode('utf-8')).hexdigest()
+    deadline = time.monotonic() + DID_IDEMPOTENCY_WAIT
+    while True:
+        slot, owner = idempotency_cache.claim(key, fingerprint)
+        if owner:
+            return slot, None
+        if slot.fingerprint != fingerprint:
+            return None, ({"error": "Idempotency-Key already used with a different request"},
+                          422, {})
+        if not slot.wait(deadline - time.monotonic()):
+            return None, ({"error": "A request with this Idempotency-Key is in progress"},
+                          409, {'Retry-After': '1'})
+        if slot.response is not None:
+            body, status, headers = slot.response
+            return None, (body, status, dict(headers, **{'Idempotent-Replayed': 'true'}))
+        # La petición original falló sin respuesta: se reintenta
+
+def finish_idempotent(slot, response):
+    """
+    Guarda la respuesta de la petición dueña de `slot`. Sin respuesta (una
+    excepción) o con un error del servidor la clave se libera para que un
+    reintento vuelva a intentarlo.
+    """
+    if response is None or response[1] >= 500:
+        idempotency_cache.release(slot)
+    else:
+        idempotency_cache.complete(slot, response)
+
+def register_did(data, public_pem, private_pem, key_type):
+    """
+    Genera el DID del par de claves y lo registra. `private_pem` es None
+    cuando la clave la aportó el cliente. Devuelve además las cabeceras
+    de la respuesta, con el número de secuencia de la escritura.
+    """
+    did = generate_did(public_pem)
+    # Un did:key derivado de una clave del cliente puede estar ya registrado
+    if private_pem is None and DID_KEY_MODE == 'derived' and registered_did(did):
+        return {"error": "DID already exists", "DID": did}, 409, {}
+
+    did_document = new_did_document(did, data, public_pem, key_type)
+
+    # Almacenar solo la clave pública
+    did_filter.add(did)
+    seq = save_registry(did, {
+        "did_document": did_document,
+        "public_key": public_pem,
+        "created": now_ms()
+    })
+    return created_response(did, did_document, public_pem, private_pem), 201, seq_headers(seq)
+
+def verify_did(did):
+    """Cuerpo y estado de /VerifyDID."""
+    if not did or did not in did_filter:
+        lookup_stats['filter_rejects'] += 1
+        return {"error": "DID not found or invalid"}, 404
+    exists = registry_store.exists(did)
+    record_storage_lookups(1, int(exists))
+    if not exists:
+        return {"error": "DID not found or invalid"}, 404
+    return {"verified": True, "DID": did}, 200
+
+def registry_document(did):
+    """
+    Respuesta codificada `(cuerpo, etag)` de /DIDRegistryGet, desde la
+    caché si está, o None si el DID no existe.
+    """
+    encoded = response_cache.get(did) if did else None
+    return encoded if encoded is not None else load_document(did)
+
+def load_document(did):
+    """Como registry_document, pero leyendo siempre el almacenamiento."""
+    generation = cache_generation(did)
+    # Un did:key derivado sin metadatos registrados se resuelve solo con su
+    # documento base
+    entry = lookup_entry(did) or expand_entry(did, None)
+    if entry is None:
+        return None
+    return cache_document(did, entry, generation)
+
+def document_cache_control():
+    if DID_CACHE_MAX_AGE > 0:
+        return f'public, max-age={DID_CACHE_MAX_AGE}'
+    return 'no-cache'
+
+def document_version(did, version_id, version_time):
+    """
+    Respuesta de /DIDRegistryGet con `versionId` o `versionTime`: devuelve
+    `((cuerpo, etag, cache_control), None)` o `(None, (cuerpo de error,
+    estado))`. No pasa por la caché de respuestas; la versión se
+    reconstruye desde el checkpoint más cercano del historial.
+    """
+    if version_id is not None and version_time is not None:
+        return None, ({"error": "Use either versionId or versionTime"}, 400)
+    if version_id is not None and not (version_id.isascii() and version_id.isdigit()):
+        return None, ({"error": "Invalid versionId"}, 400)
+    if version_time is not None:
+        try:
+            timestamp = parse_time(version_time)
+        except ValueError:
+            return None, ({"error": "Invalid versionTime"}, 400)
+
+    entry = lookup_entry(did) or expand_entry(did, None)
+    if entry is None:
+        return None, ({"error": "DID not found"}, 404)
+    current = current_version(entry)
+    if version_id is not None:
+        version = int(version_id)
+        if not 1 <= version <= current:
+            return None, ({"error": "Version not found"}, 404)
+    else:
+        timestamp = effective_time(timestamp)
+        if (last_updated(entry) or 0) <= timestamp:
+            version = current
+        elif entry.get('created', 0) > timestamp:
+            return None, ({"error": "Version not found"}, 404)
+        else:
+            version = None
+
+    if version == current:
+        body, etag = encode_document(entry)
+        return (body, etag, document_cache_control()), None
+    if follower is not None:
+        return None, ({"error": "Past versions are only kept by the primary",
+                       "primary": DID_FOLLOW}, 404)
+    if version is None:
+        version = registry_store.version_at(did, timestamp, current - 1)
+    records = registry_store.version_records(did, version) if version else []
+    if not records:
+        return None, ({"error": "Version not found"}, 404)
+    body, etag = encode_document(entry, version, records)
+    return (body, etag, IMMUTABLE_CACHE_CONTROL), None
+
+def update_patch(data):
+    """
+    Operaciones JSON Patch de una petición de /UpdateDID: `patch`, o
+    `updates` en el formato legado. Devuelve `(operaciones, None)` o
+    `(None, mensaje de error)`.
+    """
+    if 'patch' in data:
+        if 'updates' in data:
+            return None, 'Use either patch or updates'
+        return data['patch'], invalid_patch(data['patch'])
+    updates = data.get('updates', {})
+    if not isinstance(updates, dict):
+        return None, 'updates must be an object'
+    return updates_to_patch(updates), None
+
+def prepare_update(data):
+    """
+    Comprueba una petición de /UpdateDID hasta antes de verificar la firma.
+    Devuelve `((did, patch, public_key, signature), None)` o
+    `(None, (cuerpo de error, estado))`.
+    """
+    did = data.get('did')
+    signature_b64 = data.get('signature')
+
+    entry = lookup_entry(did)
+    if entry is None:
+        return None, ({'error': 'DID not found'}, 404)
+
+    # Recuperar la public_key del registro
+    public_pem = entry.get('public_key')
+    if not public_pem:
+        return None, ({'error': 'No public key found for DID'}, 403)
+
+    try:
+        with metrics.stage('key_load'):
+            public_key = public_key_cache.load(did, public_pem)
+        signature = base64.b64decode(signature_b64)
+    except Exception as e:
+        return None, invalid_signature(e)
+
+    patch, error = update_patch(data)
+    if error:
+        return None, ({'error': 'Invalid patch', 'details': error}, 400)
+    return (did, patch, public_key, signature), None
+
+def encode_cursor(did):
+    return base64.urlsafe_b64encode(did.encode('utf-8')).rstrip(b'=').decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_',
+                                validate=True).decode('utf-8')
+    except ValueError:
+        return None
+
+def list_dids(args):
+    """
+    Cuerpo y estado de /DIDs. `args` son los parámetros de la consulta:
+    uno o más de INDEXED_FIELDS, y opcionalmente `cursor` y `limit`.
+    """
+    filters = {field: args[field] for field in INDEXED_FIELDS if field in args}
+    if not filters:
+        return {"error": f"Expected at least one of: {', '.join(INDEXED_FIELDS)}"}, 400
+    try:
+        limit = int(args.get('limit', DID_LIST_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= DID_LIST_MAX_LIMIT:
+        return {"error": f"limit must be between 1 and {DID_LIST_MAX_LIMIT}"}, 400
+    after = None
+    if args.get('cursor'):
+        after = decode_cursor(args['cursor'])
+        if after is None:
+            return {"error": "Invalid cursor"}, 400
+
+    # Se pide uno más para saber si hay otra página
+    dids = registry_store.find(filters, after, limit + 1)
+    more = len(dids) > limit
+    dids = dids[:limit]
+    return {
+        "DIDs": dids,
+        "nextCursor": encode_cursor(dids[-1]) if more else None
+    }, 200
+
+def change_events(changes, entries=False):
+    """
+    Eventos de /changes. Con `entries` cada uno lleva la entrada actual
+    del DID tal como está almacenada (lo que usan los seguidores).
+    """
+    if not entries:
+        return [{"seq": seq, "did": did} for seq, did in changes]
+    stored = registry_store.get_many([did for _, did in changes])
+    return [{"seq": seq, "did": did, "entry": stored.get(did)} for seq, did in changes]
+
+def head_event():
+    return f'event: head\ndata: {json.dumps({"lastSeq": registry_store.last_change()})}\n\n'
+
+def changes_gone(since):
+    return {
+        "error": f"Changes since {since} are no longer available",
+        "lastSeq": registry_store.last_change()
+    }, 410
+
+def parse_changes_request(args, last_event_id=None):
+    """
+    `((since, limit, wait, entries), None)` con los parámetros de
+    /changes, o `(None, (cuerpo de error, estado))`. `Last-Event-ID`
+    (reconexión SSE) tiene prioridad sobre `since`.
+    """
+    try:
+        since = last_event_id or args.get('since')
+        since = int(since) if since is not None else None
+        limit = int(args.get('limit', DID_CHANGES_MAX_LIMIT))
+        wait = float(args.get('wait', 0))
+    except ValueError:
+        return None, ({"error": "since, limit and wait must be numbers"}, 400)
+    if since is not None and since < 0:
+        return None, ({"error": "since must be a sequence number"}, 400)
+    if not 1 <= limit <= DID_CHANGES_MAX_LIMIT:
+        return None, ({"error": f"limit must be between 1 and {DID_CHANGES_MAX_LIMIT}"}, 400)
+    wait = min(max(wait, 0.0), DID_CHANGES_MAX_WAIT)
+    return (since, limit, wait, args.get('entries') == '1'), None
+
+def poll_changes(since, limit, wait, entries=False):
+    """
+    Cuerpo y estado de /changes en modo long-poll: los cambios posteriores
+    a `since` o, si no hay ninguno, los que lleguen en `wait` segundos.
+    """
+    changes = registry_store.changes_since(since, limit)
+    if changes is None:
+        return changes_gone(since)
+    if not changes and wait > 0 and registry_store.wait_for_change(since, wait):
+        changes = registry_store.changes_since(since, limit)
+        if changes is None:
+            return changes_gone(since)
+    return {
+        "changes": change_events(changes, entries),
+        "lastSeq": changes[-1][0] if changes else since
+    }, 200
+
+def stream_changes(since, limit, entries=False):
+    """
+    Eventos SSE con los cambios posteriores a `since`: `change` por cada
+    uno (con `id` = secuencia, para reconectar con Last-Event-ID), `head`
+    con el último número de secuencia tras cada tanda y como keep-alive si
+    no hay cambios, y `gone` antes de cerrar si el suscriptor se quedó
+    atrás más de lo que se conserva.
+    """
+    while True:
+        changes = registry_store.changes_since(since, limit)
+        if changes is None:
+            body, _ = changes_gone(since)
+            yield f'event: gone\ndata: {json.dumps(body)}\n\n'
+            return
+        for event in change_events(changes, entries):
+            yield f'id: {event["seq"]}\nevent: change\ndata: {json.dumps(event)}\n\n'
+        if changes:
+            since = changes[-1][0]
+            yield head_event()
+        elif not registry_store.wait_for_change(since, DID_CHANGES_HEARTBEAT):
+            yield head_event()
+
+def invalid_signature(error):
+    return {'error': 'Invalid signature', 'details': str(error)}, 403
+
+def apply_update(did, patch):
+    """
+    Aplica el JSON Patch al DID Document como una versión nueva: todas las
+    operaciones o ninguna (409 si alguna falla). La entrada se reemplaza
+    completa en lugar de modificarse en el sitio, pero el almacén solo
+    persiste el cambio. Como register_did, devuelve también las cabeceras
+    de la respuesta.
+    """
+    with update_locks[hash(did) % UPDATE_LOCK_STRIPES]:
+        # La lock solo serializa este proceso: si otro worker actualizó el
+        # DID entre la lectura y la escritura, se relee y se reintenta
+        while True:
+            stored = registry_store.get(did)
+            entry = expand_entry(did, stored)
+            try:
+                did_document = apply_patch(entry['did_document'], patch)
+                if not isinstance(did_document, dict):
+                    raise PatchError('The DID Document must be an object')
+                removed = removed_base_fields(did, did_document)
+                if removed:
+                    raise PatchError(f'Cannot remove {", ".join(removed)} from a derived did:key')
+            except PatchError as e:
+                return {'error': 'Patch could not be applied', 'details': str(e)}, 409, {}
+            entry, versions = record_update(entry, did_document,
+                                            DID_VERSION_CHECKPOINT_INTERVAL)
+            try:
+                seq = save_registry(did, entry, previous=stored, versions=versions)
+            except UpdateConflict:
+                continue
+            break
+    return {
+        'status': 'DID Document updated',
+        'DIDDocument': did_document,
+        'versionId': str(current_version(entry))
+    }, 200, seq_headers(seq)
+
+def new_did(data):
+    """Cuerpo, estado y cabeceras de /CreateDID."""
+    # Validar que se proporcionen los datos básicos
+    error = invalid_create_request(data)
+    if error:
+        return {"error": error}, 400, {}
+
+    # Usar la clave del cliente o tomar un par del pool
+    supplied = client_key(data)
+    if supplied is not None:
+        (public_pem, key_type), private_pem = supplied, None
+    else:
+        key_type = data.get('keyType', DEFAULT_KEY_TYPE)
+        with metrics.stage('keygen'):
+            public_pem, private_pem = key_pool.acquire(key_type)
+
+    return register_did(data, public_pem, private_pem, key_type)
+
+@app.route('/CreateDID', methods=['POST'])
+def create_did():
+    """
+    Crea un DID, genera un par de claves del tipo `keyType` (RSA-2048 por
+    defecto) y almacena solo la clave pública en el servidor. Si el cliente
+    envía su propia clave pública (`publicKey`, en PEM o JWK) no se genera
+    ningún par y la respuesta no lleva PrivateKey.
+
+    Con la cabecera `Idempotency-Key`, un reintento con la misma clave y el
+    mismo cuerpo recibe la respuesta original en lugar de crear otro DID.
+    """
+    data = request.json
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        body, status, headers = new_did(data)
+        return jsonify(body), status, headers
+
+    slot, replayed = claim_idempotency_key(key, data)
+    if replayed:
+        body, status, headers = replayed
+        return jsonify(body), status, headers
+    response = None
+    try:
+        response = new_did(data)
+    finally:
+        finish_idempotent(slot, response)
+    body, status, headers = response
+    return jsonify(body), status, headers
+
+@app.route('/CreateDIDBatch', methods=['POST'])
+def create_did_batch():
+    """
+    Crea varios DIDs en una sola petición. Los pares de claves se generan
+    en paralelo en el pool de procesos y cada resultado se envía como una
+    línea NDJSON (con su `index` en la petición) en cuanto está listo.
+    Todo el lote se persiste en un único commit; la última línea indica si
+    ese commit tuvo éxito (con el número de secuencia de la última
+    escritura), y solo entonces los DIDs anteriores quedan registrados.
+    Los elementos con `publicKey` propia no pasan por el pool y se
+    responden primero.
+    """
+    items = request.json
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty array of DIDs"}), 400
+    if len(items) > DID_BATCH_MAX_SIZE:
+        return jsonify({"error": f"Batch too large (max {DID_BATCH_MAX_SIZE})"}), 413
+    for index, data in enumerate(items):
+        error = invalid_create_request(data)
+        if error:
+            return jsonify({"error": error, "index": index}), 400
+    if DID_KEY_MODE == 'derived':
+        seen = set()
+        for index, data in enumerate(items):
+            supplied = client_key(data)
+            if supplied is None:
+                continue
+            did = did_from_pem(supplied[0])
+            if did in seen or registered_did(did):
+                return jsonify({"error": "DID already exists", "DID": did, "index": index}), 409
+            seen.add(did)
+
+    def key_pairs():
+        generated = []
+        for index, data in enumerate(items):
+            supplied = client_key(data)
+            if supplied is not None:
+                public_pem, key_type = supplied
+                yield index, key_type, public_pem, None
+            else:
+                generated.append(index)
+        if not generated:
+            return
+        key_types = [items[index].get('keyType', DEFAULT_KEY_TYPE) for index in generated]
+        for position, (public_pem, private_pem) in key_pool.generate(key_types):
+            yield generated[position], key_types[position], public_pem, private_pem
+
+    def generate():
+        entries = []
+        for index, key_type, public_pem, private_pem in key_pairs():
+            did = generate_did(public_pem)
+            did_document = new_did_document(did, items[index], public_pem, key_type)
+            entries.append((did, {
+                "did_document": did_document,
+                "public_key": public_pem,
+                "created": now_ms()
+            }))
+            yield json.dumps(dict(
+                {"index": index},
+                **created_response(did, did_document, public_pem, private_pem)
+            )) + '\n'
+
+        for did, _ in entries:
+            did_filter.add(did)
+        try:
+            with metrics.stage('persist'):
+                seqs = registry_store.put_many([(did, metadata_entry(did, entry))
+                                                for did, entry in entries])
+        except Exception as e:
+            yield json.dumps({"status": "failed", "error": str(e)}) + '\n'
+            return
+        for did, _ in entries:
+            invalidate_document(did)
+        yield json.dumps({"status": "committed", "count": len(entries), "seq": seqs[-1]}) + '\n'
+
+    return Response(generate(), status=201, mimetype='application/x-ndjson')
 
 @app.route('/VerifyDID', methods=['GET'])
 def verify_credential():
     """
     Verifica si un DID existe en el registro.
     """
-    did = request.args.get('did')
-    if not did or did not in did_registry:
-        return jsonify({"error": "DID not found or invalid"}), 404
-
-    return jsonify({"verified": True, "DID": did}), 200
+    body, status = verify_did(request.args.get('did'))
+    return jsonify(body), status
 
 @app.route('/DIDRegistryGet', methods=['GET'])
 def get_did_registry():
     """
-    Retorna el DID Document y la clave pública almacenada.
+    Retorna el DID Document y la clave pública almacenada. La respuesta se
+    sirve ya codificada desde la caché y admite GET condicional con ETag
+    (If-None-Match -> 304). Con `versionId` o `versionTime` devuelve la
+    versión pedida del documento.
     """
     did = request.args.get('did')
-    if not did or did not in did_registry:
-        return jsonify({"error": "DID not found"}), 404
+    version_id = request.args.get('versionId')
+    version_time = request.args.get('versionTime')
+    if version_id is not None or version_time is not None:
+        encoded, error = document_version(did, version_id, version_time)
+        if error:
+            return jsonify(error[0]), error[1]
+        body, etag, cache_control = encoded
+    else:
+        encoded = registry_document(did)
+        if encoded is None:
+            return jsonify({"error": "DID not found"}), 404
+        (body, etag), cache_control = encoded, document_cache_control()
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
-    entry = did_registry[did]
+@app.route('/VerifyDIDBatch', methods=['POST'])
+def verify_credential_batch():
+    """
+    Verifica la existencia de varios DIDs en una sola petición.
+    """
+    dids, error = requested_dids()
+    if error:
+        return error
+
+    candidates = filter_dids(dids)
+    existing = registry_store.exists_many(candidates) if candidates else set()
+    record_storage_lookups(len(candidates), len(existing))
     return jsonify({
-        "DID_Document": entry["did_document"],
-        "PublicKey": entry["public_key"]
+        "verified": [did for did in dids if did in existing],
+        "notFound": [did for did in dids if did not in existing]
+    }), 200
+
+@app.route('/DIDRegistryGetBatch', methods=['POST'])
+def get_did_registry_batch():
+    """
+    Retorna los DID Documents de varios DIDs. Cada documento se toma ya
+    codificado de la caché de respuestas y solo los que faltan se leen del
+    almacenamiento.
+    """
+    dids, error = requested_dids()
+    if error:
+        return error
+
+    bodies = {}
+    for did in dids:
+        encoded = response_cache.get(did)
+        if encoded is not None:
+            bodies[did] = encoded[0]
+    missing = filter_dids([did for did in dids if did not in bodies])
+    generations = {did: cache_generation(did) for did in dids if did not in bodies}
+    entries = registry_store.get_many(missing) if missing else {}
+    record_storage_lookups(len(missing), len(entries))
+    for did in dids:
+        if did in bodies:
+            continue
+        entry = expand_entry(did, entries.get(did))
+        if entry is not None:
+            bodies[did] = cache_document(did, entry, generations[did])[0]
+
+    found = b','.join(json.dumps(did).encode('utf-8') + b':' + bodies[did]
+                      for did in dids if did in bodies)
+    not_found = json.dumps([did for did in dids if did not in bodies])
+    body = b'{"found":{' + found + b'},"notFound":' + not_found.encode('utf-8') + b'}'
+    return Response(body, status=200, mimetype='application/json')
+
+@app.route('/VerifySignatures', methods=['POST'])
+def verify_signatures():
+    """
+    Verifica en lote firmas de mensajes hechas con las claves de DIDs
+    registrados. Se espera `{"items": [{did, message, signature}, ...]}`,
+    con la firma en base64 sobre el mensaje en UTF-8. La clave de cada DID
+    distinto se resuelve una sola vez y las verificaciones se reparten
+    entre los hilos de verify_executor. La respuesta trae un resultado por
+    elemento, en el mismo orden.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected {\"items\": [...]}"}), 400
+    if len(items) > DID_VERIFY_BATCH_MAX_SIZE:
+        return jsonify({"error": f"Batch too large (max {DID_VERIFY_BATCH_MAX_SIZE})"}), 413
+
+    well_formed = [isinstance(item, dict) and
+                   all(isinstance(item.get(field), str) for field in ('did', 'message', 'signature'))
+                   for item in items]
+    keys = resolve_public_keys(list(dict.fromkeys(
+        item['did'] for item, ok in zip(items, well_formed) if ok)))
+
+    results = [None] * len(items)
+    checks, positions = [], []
+    for index, (item, ok) in enumerate(zip(items, well_formed)):
+        if not ok:
+            results[index] = {"valid": False, "error": "Missing required fields"}
+            continue
+        public_key = keys.get(item['did'])
+        if public_key is None:
+            results[index] = {"valid": False, "error": "DID not found"}
+            continue
+        try:
+            signature = base64.b64decode(item['signature'], validate=True)
+        except ValueError:
+            results[index] = {"valid": False, "error": "Invalid signature encoding"}
+            continue
+        checks.append((public_key, signature, item['message'].encode('utf-8')))
+        positions.append(index)
+
+    with metrics.stage('verify_batch'):
+        verified = verify_many(checks, verify_executor, DID_VERIFY_THREADS)
+    for index, valid in zip(positions, verified):
+        results[index] = {"valid": valid}
+    return jsonify({
+        "results": results,
+        "valid": sum(result["valid"] for result in results)
     }), 200
 
 @app.route('/UpdateDID', methods=['POST'])
 def update_did():
     """
-    Actualiza el DID Document si la firma RSA es válida.
+    Actualiza el DID Document si la firma es válida.
     Se espera:
       - did: El DID a actualizar
-      - signature: Firma RSA (base64) de la cadena 'did' con la clave privada
+      - signature: Firma (base64) de la cadena 'did' con la clave privada;
+        RSA PKCS1v15/SHA-256, Ed25519 o ECDSA P-256/SHA-256 según la clave
+      - patch: Operaciones JSON Patch (RFC 6902) sobre el DID Document, o
       - updates: Campos que se quieren actualizar en el DID Document
     """
     data = request.json
-    did = data.get('did')
-    signature_b64 = data.get('signature')
-    updates = data.get('updates', {})
-
-    if not did or did not in did_registry:
-        return jsonify({'error': 'DID not found'}), 404
-
-    # Recuperar la public_key del registro
-    public_pem = did_registry[did].get('public_key')
-    if not public_pem:
-        return jsonify({'error': 'No public key found for DID'}), 403
+    prepared, error = prepare_update(data)
+    if error:
+        return jsonify(error[0]), error[1]
+    did, patch, public_key, signature = prepared
 
     # Verificar la firma
     try:
-        public_key = serialization.load_pem_public_key(public_pem.encode('utf-8'))
-        signature = base64.b64decode(signature_b64)
-        # Se firma la cadena "did" (puede ajustarse según necesidad real)
-        public_key.verify(
-            signature,
-            did.encode('utf-8'),
-            padding.PKCS1v15(),
-            hashes.SHA256()
-        )
+        # Se firma la cadena "did" (puede ajustarse según necesidad real).
+        # El esquema se elige según el tipo real de la clave registrada y no
+        # según keyType, que es un campo editable del documento.
+        with metrics.stage('verify'):
+            verify_signature(public_key, signature, did.encode('utf-8'))
     except Exception as e:
-        return jsonify({'error': 'Invalid signature', 'details': str(e)}), 403
+        body, status = invalid_signature(e)
+        return jsonify(body), status
 
-    # Actualizar el DID Document con los campos recibidos
-    did_registry[did]['did_document'].update(updates)
-    save_registry()
+    body, status, headers = apply_update(did, patch)
+    return jsonify(body), status, headers
 
-    return jsonify({
-        'status': 'DID Document updated',
-        'DIDDocument': did_registry[did]['did_document']
-    }), 200
+@app.route('/DIDs', methods=['GET'])
+def get_dids():
+    """
+    Lista, en orden, los DIDs cuyo documento tiene los valores pedidos de
+    controller, name y/o purpose, usando los índices secundarios del
+    almacenamiento. Se pagina con `limit` y el `nextCursor` de la página
+    anterior; no se recorre el registro completo.
+    """
+    body, status = list_dids(request.args)
+    return jsonify(body), status
+
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    """
+    Cambios del registro a partir de un número de secuencia, para que las
+    cachés externas invaliden solo los DIDs creados o modificados:
+      - `since`: último número de secuencia ya procesado.
+      - `wait`: segundos que se espera a un cambio si no hay ninguno
+        (long-poll, como mucho DID_CHANGES_MAX_WAIT).
+      - `limit`: máximo de cambios por respuesta.
+      - `entries=1`: incluir la entrada almacenada de cada DID.
+    Con `Accept: text/event-stream` la respuesta es un flujo SSE que no se
+    cierra; sin `since` empieza por los cambios posteriores a la conexión.
+    Si los cambios pedidos ya no se conservan responde 410 y el cliente
+    debe volver a leer lo que tenga en caché.
+    """
+    params, error = parse_changes_request(request.args, request.headers.get('Last-Event-ID'))
+    if error:
+        return jsonify(error[0]), error[1]
+    since, limit, wait, entries = params
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        if since is None:
+            since = registry_store.last_change()
+        elif registry_store.changes_since(since, 1) is None:
+            body, status = changes_gone(since)
+            return jsonify(body), status
+        response = Response(stream_changes(since, limit, entries), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    if since is None:
+        return jsonify({"error": "Missing since"}), 400
+    body, status = poll_changes(since, limit, wait, entries)
+    return jsonify(body), status
+
+@app.route('/snapshot', methods=['GET'])
+def get_snapshot():
+    """
+    Registro completo en NDJSON para arrancar un seguidor: la primera
+    línea es `{"seq": n}` y después una línea `{"did", "entry"}` por DID,
+    con la entrada tal como está almacenada. `n` se lee antes que las
+    entradas, así que el seguidor puede continuar con /changes desde `n`:
+    reaplicar un cambio ya incluido es inocuo.
+    """
+    seq = registry_store.last_change()
+
+    def generate():
+        yield json.dumps({"seq": seq}) + '\n'
+        dids = list(registry_store.iter_dids())
+        for start in range(0, len(dids), DID_LOOKUP_BATCH_MAX_SIZE):
+            entries = registry_store.get_many(dids[start:start + DID_LOOKUP_BATCH_MAX_SIZE])
+            for did, entry in entries.items():
+                yield json.dumps({"did": did, "entry": entry}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/ReplicationStatus', methods=['GET'])
+def replication_status():
+    """
+    Estado de la replicación: en un seguidor, su número de secuencia, el
+    del primario que conoce y el retraso; en el primario, su secuencia.
+    """
+    if follower is None:
+        return jsonify({"role": "primary", "seq": registry_store.last_change()}), 200
+    return jsonify(follower.status()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Métricas en formato de texto de Prometheus: peticiones y latencia por
+    ruta, duración de las etapas y estadísticas de pool, commits y cachés.
+    """
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+def serve_worker(listener, cursor):
+    """Cuerpo de un worker de `serve`, ya en el proceso hijo."""
+    from werkzeug.serving import make_server
+
+    def stop(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    registry_store.after_fork()
+    if hasattr(idempotency_cache, 'after_fork'):
+        idempotency_cache.after_fork()
+    change_sync['cursor'] = cursor
+    # El pool de claves (o la replicación) se arranca después del fork:
+    # cada worker tiene sus propios procesos generadores
+    start_background()
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        stop_background()
+        registry_store.close()
+
+def serve(workers, host, port):
+    """
+    Servidor pre-fork: el proceso padre abre el socket y crea `workers`
+    procesos que aceptan conexiones sobre él. Las escrituras se coordinan
+    en la base SQLite compartida y cada worker ve los cambios de los demás
+    con un retraso de a lo sumo DID_SYNC_INTERVAL_MS. El padre reemplaza
+    a los workers que terminan y los detiene con SIGTERM/SIGINT.
+    """
+    global idempotency_cache
+    if workers > 1 and DID_FOLLOW:
+        sys.exit('serve --workers > 1 is not supported in follower mode (DID_FOLLOW)')
+    if workers > 1 and DID_STORAGE != 'sqlite':
+        sys.exit('serve --workers > 1 requires DID_STORAGE=sqlite')
+    if workers > 1 and DID_IDEMPOTENCY_CACHE_SIZE > 0:
+        # Un reintento puede llegar a otro worker: las claves de
+        # idempotencia se reservan en la base compartida
+        idempotency_cache = SQLiteIdempotencyCache(registry_store.path,
+                                                   DID_IDEMPOTENCY_CACHE_SIZE,
+                                                   DID_IDEMPOTENCY_TTL, DID_IDEMPOTENCY_LEASE)
+    if workers > 1:
+        split_key_pool(workers)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    cursor = registry_store.last_change() if workers > 1 else None
+
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(listener, cursor)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f' * Serving on http://{host}:{port} with {workers} worker(s)', flush=True)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            spawn()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='DID provider API')
+    subcommands = parser.add_subparsers(dest='command')
+    serve_parser = subcommands.add_parser(
+        'serve', help='Pre-forked multi-process server (sqlite storage)')
+    serve_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.workers, args.host, args.port)
+    else:
+        # Con el recargador de Werkzeug solo el proceso hijo sirve peticiones
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background()
+        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
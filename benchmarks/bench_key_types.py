@@ -0,0 +1,87 @@
+"""
+Microbenchmark de los tipos de clave admitidos en /CreateDID.
+
+Para cada tipo mide generación de claves, firma y verificación por
+segundo (con el mismo esquema que usa /UpdateDID), y los bytes que ocupa
+un DID en el registro legado (`did_registry.json`) y en el formato
+compacto de did_records.
+
+Uso:
+    python benchmarks/bench_key_types.py --seconds 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding
+
+from did_crypto import KEY_TYPES, generate_key_pair, verify_signature
+from did_records import encode_entry
+
+DID = 'did:key:123e4567-e89b-12d3-a456-426614174000'
+
+
+def sign(private_key, message):
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return private_key.sign(message)
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return private_key.sign(message, ec.ECDSA(hashes.SHA256()))
+    return private_key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+
+
+def rate(function, seconds):
+    """Operaciones por segundo de `function` durante unos `seconds`."""
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        function()
+        count += 1
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=2.0,
+                        help='duration of each measurement')
+    args = parser.parse_args()
+
+    message = DID.encode('utf-8')
+    print(f'{"key type":<10} {"keygen/s":>10} {"sign/s":>10} {"verify/s":>10}'
+          f' {"sig bytes":>10} {"legacy B/DID":>13} {"compact B/DID":>14}')
+    for key_type in KEY_TYPES:
+        public_pem, private_pem = generate_key_pair(key_type)
+        private_key = serialization.load_pem_private_key(private_pem.encode('utf-8'), None)
+        public_key = serialization.load_pem_public_key(public_pem.encode('utf-8'))
+        signature = sign(private_key, message)
+
+        entry = {
+            'did_document': {
+                'id': DID,
+                'controller': 'End User',
+                'name': 'Example DID',
+                'purpose': 'Authentication',
+                'keyType': key_type,
+                'publicKey': public_pem,
+            },
+            'public_key': public_pem,
+        }
+        legacy_bytes = len(json.dumps({DID: entry}, indent=4))
+        compact_bytes = len(DID) + 2 + len(encode_entry(entry))
+
+        keygen = rate(lambda: generate_key_pair(key_type), args.seconds)
+        signs = rate(lambda: sign(private_key, message), args.seconds)
+        verifies = rate(lambda: verify_signature(public_key, signature, message), args.seconds)
+        print(f'{key_type:<10} {keygen:>10.1f} {signs:>10.1f} {verifies:>10.1f}'
+              f' {len(signature):>10} {legacy_bytes:>13} {compact_bytes:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Costo por petición de cargar la clave pública en /UpdateDID.
+
+Compara `load_pem_public_key` en cada verificación (comportamiento
+anterior) con la caché PublicKeyCache, usando varios DIDs que se
+actualizan de forma repetida.
+
+Uso:
+    python benchmarks/bench_public_key_cache.py --dids 8 --requests 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from did_crypto import PublicKeyCache, generate_key_pair
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--dids', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    identities = []
+    for i in range(args.dids):
+        did = f'did:key:bench-{i}'
+        public_pem, private_pem = generate_key_pair()
+        private_key = serialization.load_pem_private_key(private_pem.encode('utf-8'), None)
+        signature = private_key.sign(did.encode('utf-8'), padding.PKCS1v15(), hashes.SHA256())
+        identities.append((did, public_pem, signature))
+
+    def run(load):
+        start = time.perf_counter()
+        for n in range(args.requests):
+            did, public_pem, signature = identities[n % len(identities)]
+            load(did, public_pem).verify(signature, did.encode('utf-8'),
+                                         padding.PKCS1v15(), hashes.SHA256())
+        return (time.perf_counter() - start) / args.requests
+
+    def load_uncached(did, public_pem):
+        return serialization.load_pem_public_key(public_pem.encode('utf-8'))
+
+    def load_only(load):
+        start = time.perf_counter()
+        for n in range(args.requests):
+            did, public_pem, _ = identities[n % len(identities)]
+            load(did, public_pem)
+        return (time.perf_counter() - start) / args.requests
+
+    cache = PublicKeyCache(max_size=args.dids)
+    print(f'{args.requests} requests over {args.dids} DIDs (microseconds per request)')
+    print(f'  key load, uncached:      {load_only(load_uncached) * 1e6:8.1f}')
+    print(f'  key load, cached:        {load_only(cache.load) * 1e6:8.1f}')
+    print(f'  load + verify, uncached: {run(load_uncached) * 1e6:8.1f}')
+    print(f'  load + verify, cached:   {run(cache.load) * 1e6:8.1f}')
+    print(f'  cache stats: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Tamaño en disco y tiempo de lectura del registro: formato legado
+(`did_registry.json` con indent=4 y la clave PEM duplicada) frente al
+snapshot en formato compacto de did_records.
+
+El registro sintético reutiliza un conjunto pequeño de claves RSA reales,
+así que el contenido de cada entrada tiene el tamaño de una real.
+
+Uso:
+    python benchmarks/bench_record_format.py --count 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from did_crypto import generate_key_pair
+from did_records import decode_entry, encode_entry
+
+
+def synthetic_registry(count, keys):
+    public_pems = [generate_key_pair()[0] for _ in range(keys)]
+    registry = {}
+    for i in range(count):
+        did = f'did:key:{uuid.uuid4()}'
+        public_pem = public_pems[i % keys]
+        registry[did] = {
+            'did_document': {
+                'id': did,
+                'controller': 'End User' if i % 10 else 'IM Provider',
+                'name': f'User {i}',
+                'purpose': 'End-user identity',
+                'publicKey': public_pem,
+            },
+            'public_key': public_pem,
+        }
+    return registry
+
+
+def timed(function):
+    gc.collect()
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--keys', type=int, default=16)
+    args = parser.parse_args()
+
+    registry = synthetic_registry(args.count, args.keys)
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, 'did_registry.json')
+        compact_path = os.path.join(directory, 'did_registry.snapshot')
+
+        with open(legacy_path, 'w') as f:
+            json.dump(registry, f, indent=4)
+        with open(compact_path, 'w') as f:
+            for did, entry in registry.items():
+                f.write(did + '\t' + encode_entry(entry) + '\n')
+        del registry
+
+        def load_legacy():
+            with open(legacy_path, 'r') as f:
+                return len(json.load(f))
+
+        def load_compact():
+            entries = {}
+            with open(compact_path, 'r') as f:
+                for line in f:
+                    did, _, record = line.rstrip('\n').partition('\t')
+                    entries[did] = decode_entry(record)
+            return len(entries)
+
+        def index_compact():
+            index = {}
+            offset = 0
+            with open(compact_path, 'rb') as f:
+                for line in f:
+                    index[line[:line.index(b'\t')].decode('utf-8')] = offset
+                    offset += len(line)
+            return len(index)
+
+        legacy_size = os.path.getsize(legacy_path)
+        compact_size = os.path.getsize(compact_path)
+        _, legacy_time = timed(load_legacy)
+        _, compact_time = timed(load_compact)
+        _, index_time = timed(index_compact)
+
+    print(f'{args.count} DIDs')
+    print(f'  legacy JSON:     {legacy_size / 2**20:9.1f} MiB, full parse {legacy_time:7.2f} s')
+    print(f'  compact records: {compact_size / 2**20:9.1f} MiB, full parse {compact_time:7.2f} s')
+    print(f'  compact records: offset index only (lazy startup) {index_time:7.2f} s')
+    print(f'  size ratio: {compact_size / legacy_size:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Firmas verificadas por segundo en /VerifySignatures según el número de hilos.
+
+Usa verify_many, la misma función que reparte las verificaciones del
+endpoint entre los hilos de un ThreadPoolExecutor. `cryptography` libera
+el GIL al verificar, así que el rendimiento debería crecer con los hilos
+hasta el número de núcleos.
+
+Uso:
+    python benchmarks/bench_verify_signatures.py --items 5000 --threads 1,2,4,8
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding
+
+from did_crypto import KEY_TYPES, generate_key_pair, verify_many
+
+
+def sign(private_key, message):
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return private_key.sign(message)
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return private_key.sign(message, ec.ECDSA(hashes.SHA256()))
+    return private_key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--dids', type=int, default=16,
+                        help='distinct keys the signatures are spread over')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='comma-separated thread counts')
+    parser.add_argument('--key-type', default='RSA-2048', choices=KEY_TYPES)
+    args = parser.parse_args()
+
+    keys = []
+    for _ in range(args.dids):
+        public_pem, private_pem = generate_key_pair(args.key_type)
+        keys.append((serialization.load_pem_public_key(public_pem.encode('utf-8')),
+                     serialization.load_pem_private_key(private_pem.encode('utf-8'), None)))
+    checks = []
+    for i in range(args.items):
+        public_key, private_key = keys[i % len(keys)]
+        message = f'message {i}'.encode('utf-8')
+        checks.append((public_key, sign(private_key, message), message))
+
+    print(f'{args.items} {args.key_type} signatures, {os.cpu_count()} CPUs')
+    print(f'{"threads":>8} {"items/s":>10} {"speedup":>8}')
+    baseline = None
+    for threads in (int(value) for value in args.threads.split(',')):
+        with ThreadPoolExecutor(threads) as executor:
+            start = time.perf_counter()
+            results = verify_many(checks, executor, threads)
+            elapsed = time.perf_counter() - start
+        assert all(results)
+        rate = args.items / elapsed
+        baseline = baseline or rate
+        print(f'{threads:>8} {rate:>10.1f} {rate / baseline:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""
+Prueba de carga de la API de DIDs contra un servidor local.
+
+Siembra un registro del tamaño indicado (de 1k a 1M DIDs) en un
+directorio temporal, arranca el servidor como subproceso sobre ese
+registro y lo somete a una mezcla configurable de CreateDID, VerifyDID,
+DIDRegistryGet y UpdateDID desde varios hilos, cada uno con su conexión
+keep-alive. Reporta el rendimiento y las latencias p50/p95/p99 por
+operación en JSON, para poder comparar ejecuciones.
+
+El registro sembrado reutiliza un conjunto pequeño de claves, así que las
+firmas de UpdateDID se calculan antes de empezar y no cuentan en la
+medición. El cliente corre en el mismo equipo que el servidor y compite
+con él por la CPU.
+
+Uso:
+    python benchmarks/loadtest.py --dids 100000 --storage sqlite \\
+        --server serve --workers 4 --duration 30 --concurrency 16 \\
+        --mix create=1,verify=10,get=20,update=2 --output run.json
+"""
+import argparse
+import base64
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding
+
+from did_crypto import KEY_TYPES, generate_key_pair
+from did_records import encode_entry
+from did_storage import SQLiteStore
+
+OPERATIONS = ('create', 'verify', 'get', 'update')
+EXPECTED_STATUS = {
+    'create': (201,),
+    'verify': (200,),
+    'get': (200, 304),
+    'update': (200,),
+}
+
+
+def sign(private_key, message):
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return private_key.sign(message)
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return private_key.sign(message, ec.ECDSA(hashes.SHA256()))
+    return private_key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {name!r}')
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('The mix needs a positive weight')
+    return mix
+
+
+def seed_registry(directory, storage, count, keys):
+    """
+    Escribe `count` DIDs en el formato de `storage` y devuelve la lista de
+    DIDs sembrados; el DID en la posición i usa la clave `keys[i % len(keys)]`.
+    """
+    entries = []
+    for i in range(count):
+        did = f'did:key:{uuid.uuid4()}'
+        public_pem = keys[i % len(keys)][0]
+        entries.append((did, {
+            'did_document': {
+                'id': did,
+                'controller': 'Load Test' if i % 10 else 'IM Provider',
+                'name': f'User {i}',
+                'purpose': 'End-user identity',
+                'publicKey': public_pem,
+            },
+            'public_key': public_pem,
+        }))
+
+    if storage == 'json':
+        with open(os.path.join(directory, 'did_registry.json'), 'w') as f:
+            json.dump(dict(entries), f, indent=4)
+    elif storage == 'log':
+        with open(os.path.join(directory, 'did_registry.snapshot'), 'w') as f:
+            for did, entry in entries:
+                f.write(did + '\t' + encode_entry(entry) + '\n')
+    else:
+        store = SQLiteStore(os.path.join(directory, 'did_registry.sqlite3'))
+        store.load()
+        for start in range(0, len(entries), 10000):
+            store.put_many(entries[start:start + 10000])
+        store.close()
+    return [did for did, _ in entries]
+
+
+def start_server(args, directory):
+    env = dict(os.environ, DID_STORAGE=args.storage)
+    if args.server == 'asgi':
+        command = [sys.executable, os.path.join(ROOT, 'did_asgi.py')]
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'DIDProvider3.py'), 'serve',
+                   '--workers', str(args.workers)]
+    command += ['--host', '127.0.0.1', '--port', str(args.port)]
+    process = subprocess.Popen(command, cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'Server exited with status {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', args.port, timeout=1)
+            connection.request('GET', '/VerifyDID?did=did:key:ready')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise SystemExit('Server did not start in time')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class Client(threading.Thread):
+    """Hilo de carga con su propia conexión keep-alive."""
+
+    def __init__(self, args, dids, update_targets, seed, deadline):
+        super().__init__(daemon=True)
+        self.args = args
+        self.dids = dids
+        self.update_targets = update_targets
+        self.random = random.Random(seed)
+        self.deadline = deadline
+        self.operations, self.weights = zip(*args.mix.items())
+        self.samples = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.args.port, timeout=30)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None
+
+    def target_did(self):
+        if self.random.random() < self.args.miss_rate:
+            return f'did:key:{uuid.uuid4()}'
+        return self.random.choice(self.dids)
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            operation = self.random.choices(self.operations, self.weights)[0]
+            if operation == 'create':
+                method, path, body = 'POST', '/CreateDID', json.dumps({
+                    'entity': 'Load Test', 'name': 'New user', 'purpose': 'Benchmark',
+                    'keyType': self.args.key_type})
+            elif operation == 'verify':
+                method, path, body = 'GET', '/VerifyDID?did=' + self.target_did(), None
+            elif operation == 'get':
+                method, path, body = 'GET', '/DIDRegistryGet?did=' + self.target_did(), None
+            else:
+                did, signature = self.random.choice(self.update_targets)
+                method, path, body = 'POST', '/UpdateDID', json.dumps({
+                    'did': did, 'signature': signature,
+                    'updates': {'purpose': f'Benchmark {self.random.random()}'}})
+            start = time.perf_counter()
+            status = self.request(method, path, body)
+            elapsed = time.perf_counter() - start
+            expected = EXPECTED_STATUS[operation]
+            if operation in ('verify', 'get') and self.args.miss_rate:
+                expected = expected + (404,)
+            if status in expected:
+                self.samples[operation].append(elapsed)
+            else:
+                self.errors[operation] += 1
+        if self.connection is not None:
+            self.connection.close()
+
+
+def percentile(ordered, fraction):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, errors, duration):
+    ordered = sorted(samples)
+    milliseconds = (lambda value: round(value * 1000, 3) if value is not None else None)
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'throughput': round(len(ordered) / duration, 2),
+        'mean_ms': milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+        'p50_ms': milliseconds(percentile(ordered, 0.50)),
+        'p95_ms': milliseconds(percentile(ordered, 0.95)),
+        'p99_ms': milliseconds(percentile(ordered, 0.99)),
+        'max_ms': milliseconds(ordered[-1]) if ordered else None,
+    }
+
+
+def server_stages(port):
+    """Duración media de las etapas según /metrics del servidor, si responde."""
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.request('GET', '/metrics')
+        text = connection.getresponse().read().decode('utf-8')
+        connection.close()
+    except (OSError, http.client.HTTPException):
+        return None
+    totals = {}
+    for line in text.splitlines():
+        for suffix in ('_sum', '_count'):
+            prefix = 'did_stage_duration_seconds' + suffix + '{stage="'
+            if line.startswith(prefix):
+                stage = line[len(prefix):line.index('"', len(prefix))]
+                totals.setdefault(stage, {})[suffix] = float(line.rsplit(' ', 1)[1])
+    return {stage: {'count': int(values.get('_count', 0)),
+                    'mean_ms': round(values['_sum'] / values['_count'] * 1000, 3)
+                    if values.get('_count') else None}
+            for stage, values in sorted(totals.items())}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--dids', type=int, default=1000, help='DIDs seeded in the registry')
+    parser.add_argument('--storage', choices=('json', 'log', 'sqlite'), default='sqlite')
+    parser.add_argument('--server', choices=('serve', 'asgi'), default='serve',
+                        help='pre-forked Flask server or the ASGI app (needs uvicorn)')
+    parser.add_argument('--workers', type=int, default=1, help='serve worker processes')
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds before measuring')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('create=1,verify=10,get=20,update=2'),
+                        help='operation weights, e.g. create=1,verify=10,get=20,update=2')
+    parser.add_argument('--miss-rate', type=float, default=0.0,
+                        help='fraction of verify/get lookups for unknown DIDs')
+    parser.add_argument('--key-type', choices=KEY_TYPES, default='RSA-2048')
+    parser.add_argument('--keys', type=int, default=16, help='distinct keys in the seeded registry')
+    parser.add_argument('--update-targets', type=int, default=1000,
+                        help='seeded DIDs with precomputed UpdateDID signatures')
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON result to this file')
+    args = parser.parse_args()
+    if args.storage != 'sqlite' and args.server == 'serve' and args.workers > 1:
+        parser.error('serve with several workers needs --storage sqlite')
+
+    keys = []
+    for _ in range(args.keys):
+        public_pem, private_pem = generate_key_pair(args.key_type)
+        keys.append((public_pem, serialization.load_pem_private_key(private_pem.encode('utf-8'), None)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        dids = seed_registry(directory, args.storage, args.dids, keys)
+        seed_seconds = time.perf_counter() - start
+
+        rng = random.Random(args.seed)
+        update_targets = []
+        for position in rng.sample(range(len(dids)), min(args.update_targets, len(dids))):
+            did = dids[position]
+            signature = sign(keys[position % len(keys)][1], did.encode('utf-8'))
+            update_targets.append((did, base64.b64encode(signature).decode('ascii')))
+
+        start = time.perf_counter()
+        process = start_server(args, directory)
+        startup_seconds = time.perf_counter() - start
+        try:
+            if args.warmup > 0:
+                warmup = [Client(args, dids, update_targets, args.seed + 1000 + i,
+                                 time.monotonic() + args.warmup)
+                          for i in range(args.concurrency)]
+                for client in warmup:
+                    client.start()
+                for client in warmup:
+                    client.join()
+
+            deadline = time.monotonic() + args.duration
+            clients = [Client(args, dids, update_targets, args.seed + i, deadline)
+                       for i in range(args.concurrency)]
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            duration = time.perf_counter() - start
+            stages = server_stages(args.port)
+        finally:
+            stop_server(process)
+
+    operations = {}
+    for name in OPERATIONS:
+        if args.mix.get(name):
+            samples = [value for client in clients for value in client.samples[name]]
+            errors = sum(client.errors[name] for client in clients)
+            operations[name] = summarize(samples, errors, duration)
+    total = summarize([value for client in clients for samples in client.samples.values()
+                       for value in samples],
+                      sum(sum(client.errors.values()) for client in clients), duration)
+
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': {
+            'dids': args.dids,
+            'storage': args.storage,
+            'server': args.server,
+            'workers': args.workers,
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'mix': args.mix,
+            'miss_rate': args.miss_rate,
+            'key_type': args.key_type,
+        },
+        'seed_seconds': round(seed_seconds, 3),
+        'startup_seconds': round(startup_seconds, 3),
+        'total': total,
+        'operations': operations,
+        'server_stages': stages,
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
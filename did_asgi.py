@@ -0,0 +1,260 @@
+"""
+Modo de servicio ASGI (asyncio) de la API de DIDs.
+
+Expone las mismas rutas básicas que la app Flask de DIDProvider3
+(/CreateDID, /VerifyDID, /DIDRegistryGet, /UpdateDID y /DIDs) y reutiliza su
+lógica y su estado: registro, pool de claves y cachés. El bucle de eventos
+nunca se bloquea:
+
+  - las respuestas que salen de la caché o del filtro de Bloom se
+    contestan directamente en el bucle;
+  - las lecturas y escrituras del almacenamiento van a un pool de hilos
+    de E/S;
+  - la generación de claves se espera sobre el Future del pool de
+    procesos y la verificación de firmas va a los hilos de verificación.
+
+Así, miles de conexiones keep-alive inactivas no ocupan un hilo cada una.
+En modo seguidor (DID_FOLLOW) rechaza las escrituras y arranca la
+replicación en lugar del pool de claves.
+La app Flask sigue disponible como punto de entrada compatible.
+
+Uso:
+    python did_asgi.py                  # requiere uvicorn
+    uvicorn did_asgi:app --port 5000    # o cualquier otro servidor ASGI
+"""
+import asyncio
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.http import parse_etags
+
+from DIDProvider3 import (DEFAULT_KEY_TYPE, METRICS_CONTENT_TYPE, apply_update,
+                          claim_idempotency_key, client_key, did_filter,
+                          document_cache_control, document_version, finish_idempotent,
+                          follower, invalid_create_request, invalid_signature, key_pool,
+                          list_dids, load_document, metrics, prepare_update, read_only_error,
+                          register_did, registry_store, resolve_did_key, response_cache,
+                          start_background, stop_background, verify_did, verify_executor,
+                          verify_signature, wait_for_seq)
+
+# Hilos para las llamadas al almacenamiento
+DID_ASGI_IO_THREADS = int(os.environ.get('DID_ASGI_IO_THREADS', '32'))
+io_executor = ThreadPoolExecutor(DID_ASGI_IO_THREADS, thread_name_prefix='did-io')
+
+
+async def run_in(executor, function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args))
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+    def header(self, name):
+        name = name.encode('latin-1')
+        for key, value in self.scope['headers']:
+            if key == name:
+                return value.decode('latin-1')
+        return None
+
+    def json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+def json_response(body, status, headers=None):
+    return status, json.dumps(body).encode('utf-8'), [(b'content-type', b'application/json')] + [
+        (name.lower().encode('latin-1'), value.encode('latin-1'))
+        for name, value in (headers or {}).items()]
+
+
+async def create_did(request):
+    data = request.json()
+    key = request.header('idempotency-key')
+    if key is None:
+        return json_response(*await new_did(data))
+
+    # Esperar a una petición en curso con la misma clave bloquea: va al pool de E/S
+    slot, replayed = await run_in(io_executor, claim_idempotency_key, key, data)
+    if replayed:
+        return json_response(*replayed)
+    response = None
+    try:
+        response = await new_did(data)
+    finally:
+        finish_idempotent(slot, response)
+    return json_response(*response)
+
+
+async def new_did(data):
+    # Validar una clave aportada por el cliente es trabajo de CPU
+    error = await run_in(verify_executor, invalid_create_request, data)
+    if error:
+        return {"error": error}, 400, {}
+
+    supplied = client_key(data)
+    if supplied is not None:
+        (public_pem, key_type), private_pem = supplied, None
+    else:
+        key_type = data.get('keyType', DEFAULT_KEY_TYPE)
+        with metrics.stage('keygen'):
+            public_pem, private_pem = await asyncio.wrap_future(key_pool.acquire_future(key_type))
+
+    return await run_in(io_executor, register_did, data, public_pem, private_pem, key_type)
+
+
+async def verify_credential(request):
+    did = request.args.get('did')
+    if not did or did not in did_filter:
+        # Rechazo del filtro de Bloom: no hay que tocar el almacenamiento
+        return json_response(*verify_did(did))
+    return json_response(*await run_in(io_executor, verify_did, did))
+
+
+async def get_did_registry(request):
+    did = request.args.get('did')
+    version_id = request.args.get('versionId')
+    version_time = request.args.get('versionTime')
+    if version_id is not None or version_time is not None:
+        encoded, error = await run_in(io_executor, document_version, did, version_id,
+                                      version_time)
+        if error:
+            return json_response(*error)
+        body, etag, cache_control = encoded
+    else:
+        encoded = response_cache.get(did) if did else None
+        if encoded is None:
+            if not did or (did not in did_filter and resolve_did_key(did) is None):
+                return json_response({"error": "DID not found"}, 404)
+            encoded = await run_in(io_executor, load_document, did)
+            if encoded is None:
+                return json_response({"error": "DID not found"}, 404)
+        (body, etag), cache_control = encoded, document_cache_control()
+
+    headers = [(b'etag', f'"{etag}"'.encode('latin-1')),
+               (b'cache-control', cache_control.encode('latin-1'))]
+    if parse_etags(request.header('if-none-match')).contains_weak(etag):
+        return 304, b'', headers
+    return 200, body, [(b'content-type', b'application/json')] + headers
+
+
+async def update_did(request):
+    data = request.json()
+    if not isinstance(data, dict):
+        return json_response({"error": "Expected a JSON object"}, 400)
+    prepared, error = await run_in(io_executor, prepare_update, data)
+    if error:
+        return json_response(*error)
+    did, patch, public_key, signature = prepared
+
+    try:
+        with metrics.stage('verify'):
+            await run_in(verify_executor, verify_signature, public_key, signature,
+                         did.encode('utf-8'))
+    except Exception as e:
+        return json_response(*invalid_signature(e))
+
+    return json_response(*await run_in(io_executor, apply_update, did, patch))
+
+
+async def get_dids(request):
+    return json_response(*await run_in(io_executor, list_dids, request.args))
+
+
+async def get_metrics(request):
+    return 200, metrics.render().encode('utf-8'), [(b'content-type', METRICS_CONTENT_TYPE.encode('latin-1'))]
+
+
+# Rutas que un seguidor rechaza
+WRITE_ROUTES = {'/CreateDID', '/UpdateDID'}
+
+ROUTES = {
+    '/CreateDID': ('POST', create_did),
+    '/VerifyDID': ('GET', verify_credential),
+    '/DIDRegistryGet': ('GET', get_did_registry),
+    '/UpdateDID': ('POST', update_did),
+    '/DIDs': ('GET', get_dids),
+    '/metrics': ('GET', get_metrics),
+}
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_background()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            stop_background()
+            io_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    start = time.perf_counter()
+    route = ROUTES.get(scope['path'])
+    if route is None:
+        status, body, headers = json_response({"error": "Not found"}, 404)
+    elif scope['method'] != route[0]:
+        status, body, headers = json_response({"error": "Method not allowed"}, 405)
+        headers.append((b'allow', route[0].encode('latin-1')))
+    elif follower is not None and scope['path'] in WRITE_ROUTES:
+        status, body, headers = json_response(*read_only_error())
+    else:
+        request = Request(scope, await read_body(receive))
+        error = None
+        if 'minSeq' in request.args:
+            error = await run_in(io_executor, wait_for_seq, request.args['minSeq'])
+        if error:
+            status, body, headers = json_response(*error, {'Retry-After': '1'})
+        else:
+            status, body, headers = await route[1](request)
+    if follower is not None and not any(name == b'x-did-seq' for name, _ in headers):
+        headers.append((b'x-did-seq', str(registry_store.last_change()).encode('latin-1')))
+
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+    metrics.observe_request(scope['path'] if route is not None else 'unmatched',
+                            scope['method'], status, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='DID provider API (ASGI mode)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('did_asgi requires an ASGI server: pip install uvicorn')
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,223 @@
+"""
+Cachés en memoria del proveedor de DIDs.
+"""
+import collections
+import hashlib
+import math
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Caché LRU acotada y segura entre hilos, con contadores de aciertos,
+    fallos y desalojos.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """Invalida una clave; devuelve el valor que tenía o None."""
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom escalable sobre los DIDs registrados.
+
+    `did in filtro` es falso solo si el DID nunca se agregó, de modo que
+    esas consultas pueden responderse sin leer el almacenamiento. Cuando
+    una capa se llena se agrega otra del doble de capacidad y con la mitad
+    de tasa de falsos positivos, para que la tasa total siga acotada por
+    `fp_rate`.
+    """
+
+    def __init__(self, capacity, fp_rate=0.01):
+        if not 0 < fp_rate < 1:
+            raise ValueError('fp_rate must be between 0 and 1')
+        self.fp_rate = fp_rate
+        self.count = 0
+        self._layers = []
+        self._layer_count = 0
+        self._lock = threading.Lock()
+        self._add_layer(max(capacity, 1), fp_rate / 2)
+
+    def _add_layer(self, capacity, fp_rate):
+        bits = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        self._layers.append((bytearray((bits + 7) // 8), bits, hashes,
+                             capacity, fp_rate))
+
+    @staticmethod
+    def _hash(item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def add(self, item):
+        h1, h2 = self._hash(item)
+        with self._lock:
+            array, bits, hashes, capacity, fp_rate = self._layers[-1]
+            for i in range(hashes):
+                position = (h1 + i * h2) % bits
+                array[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+            self._layer_count += 1
+            if self._layer_count >= capacity:
+                self._add_layer(capacity * 2, fp_rate / 2)
+                self._layer_count = 0
+
+    def __contains__(self, item):
+        h1, h2 = self._hash(item)
+        for array, bits, hashes, _, _ in self._layers:
+            for i in range(hashes):
+                position = (h1 + i * h2) % bits
+                if not array[position >> 3] & (1 << (position & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def stats(self):
+        return {
+            'items': self.count,
+            'layers': len(self._layers),
+            'bytes': sum(len(layer[0]) for layer in self._layers),
+            'fp_rate': self.fp_rate,
+        }
+
+
+class _IdempotencySlot:
+    __slots__ = ('key', 'fingerprint', 'response', 'expires', 'done')
+
+    def __init__(self, key, fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.response = None
+        # Una petición en curso no caduca
+        self.expires = math.inf
+        self.done = threading.Event()
+
+    def wait(self, timeout):
+        """Espera a que termine la petición dueña; False si vence `timeout`."""
+        return self.done.wait(max(timeout, 0))
+
+
+class IdempotencyCache:
+    """
+    Respuestas por clave de idempotencia, acotadas a `max_size` y que
+    caducan `ttl` segundos después de enviarse.
+
+    `claim` devuelve el slot de la clave y si quien llama es su dueño: el
+    dueño hace el trabajo y lo cierra con `complete` (o `release` si no hay
+    respuesta que guardar) y los demás esperan en el slot y reutilizan su
+    respuesta. Cada slot guarda la huella de la petición que lo creó.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # En orden de caducidad: los slots se mueven al final al completarse
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key, fingerprint):
+        now = time.monotonic()
+        with self._lock:
+            while self._data:
+                oldest = next(iter(self._data.values()))
+                if oldest.expires > now:
+                    break
+                del self._data[oldest.key]
+                self.expirations += 1
+            slot = self._data.get(key)
+            if slot is not None and slot.expires <= now:
+                # Caducado, pero detrás de uno en curso que aún no caduca
+                del self._data[key]
+                self.expirations += 1
+                slot = None
+            if slot is not None:
+                self.hits += 1
+                return slot, False
+            self.misses += 1
+            slot = _IdempotencySlot(key, fingerprint)
+            if self.max_size > 0:
+                self._data[key] = slot
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+            return slot, True
+
+    def complete(self, slot, response):
+        with self._lock:
+            slot.response = response
+            slot.expires = time.monotonic() + self.ttl
+            if self._data.get(slot.key) is slot:
+                self._data.move_to_end(slot.key)
+        slot.done.set()
+
+    def release(self, slot):
+        """Libera la clave sin guardar respuesta; quien espera lo reintenta."""
+        with self._lock:
+            if self._data.get(slot.key) is slot:
+                del self._data[slot.key]
+        slot.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
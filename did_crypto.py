@@ -0,0 +1,213 @@
+"""
+Operaciones criptográficas del proveedor de DIDs.
+
+Se mantienen en un módulo aparte para que los procesos del pool de claves
+puedan importarlas sin cargar la aplicación Flask ni el registro.
+"""
+import base64
+import hashlib
+import json
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+
+from did_cache import LRUCache
+
+# Tipos de clave admitidos en /CreateDID (campo keyType)
+KEY_TYPES = ('RSA-2048', 'RSA-3072', 'Ed25519', 'P-256')
+DEFAULT_KEY_TYPE = 'RSA-2048'
+
+
+def generate_key_pair(key_type=DEFAULT_KEY_TYPE):
+    """
+    Genera un par de claves del tipo indicado y devuelve
+    la clave pública y la clave privada en formato PEM.
+    """
+    if key_type in ('RSA-2048', 'RSA-3072'):
+        private_key = rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=int(key_type[4:])
+        )
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
+    elif key_type == 'Ed25519':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        private_format = serialization.PrivateFormat.PKCS8
+    elif key_type == 'P-256':
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        private_format = serialization.PrivateFormat.PKCS8
+    else:
+        raise ValueError(f'Unsupported key type: {key_type}')
+    public_key = private_key.public_key()
+
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=private_format,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode('utf-8')
+
+    public_pem = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+
+    return public_pem, private_pem
+
+
+def key_type_of(public_key):
+    """Tipo de clave (de KEY_TYPES) de un objeto de clave pública."""
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return f'RSA-{public_key.key_size}'
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return 'Ed25519'
+    if isinstance(public_key, ec.EllipticCurvePublicKey) and public_key.curve.name == 'secp256r1':
+        return 'P-256'
+    raise ValueError('Unsupported public key type')
+
+
+def verify_signature(public_key, signature, message):
+    """
+    Verifica `signature` sobre `message` según el tipo de la clave:
+    RSA con PKCS1v15/SHA-256, Ed25519, o ECDSA P-256 con SHA-256 (firma
+    DER). Lanza InvalidSignature si no es válida.
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        public_key.verify(signature, message)
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        public_key.verify(signature, message, ec.ECDSA(hashes.SHA256()))
+    else:
+        raise ValueError('Unsupported public key type')
+
+
+def _verify_chunk(checks):
+    results = []
+    for public_key, signature, message in checks:
+        try:
+            verify_signature(public_key, signature, message)
+        except Exception:
+            results.append(False)
+        else:
+            results.append(True)
+    return results
+
+
+def verify_many(checks, executor=None, workers=1):
+    """
+    Verifica una lista de `(clave, firma, mensaje)` y devuelve un booleano
+    por elemento. Con `executor` (un ThreadPoolExecutor) la lista se parte
+    en unos cuantos trozos por hilo: `cryptography` libera el GIL durante
+    la verificación, así que los hilos verifican en paralelo.
+    """
+    checks = list(checks)
+    if executor is None or workers <= 1 or len(checks) < 2:
+        return _verify_chunk(checks)
+    size = max(1, -(-len(checks) // (workers * 4)))
+    chunks = [checks[i:i + size] for i in range(0, len(checks), size)]
+    return [valid for results in executor.map(_verify_chunk, chunks) for valid in results]
+
+
+class PublicKeyCache:
+    """
+    Caché LRU de claves públicas ya cargadas, indexada por DID.
+
+    Guarda el PEM junto al objeto: si la clave registrada del DID cambia,
+    la entrada deja de coincidir y se vuelve a cargar.
+    """
+
+    def __init__(self, max_size=10000):
+        self.stale = 0
+        self._cache = LRUCache(max_size)
+
+    def load(self, did, public_pem):
+        cached = self._cache.get(did)
+        if cached is not None:
+            if cached[0] == public_pem:
+                return cached[1]
+            self.stale += 1
+        public_key = serialization.load_pem_public_key(public_pem.encode('utf-8'))
+        self._cache.put(did, (public_pem, public_key))
+        return public_key
+
+    def invalidate(self, did):
+        self._cache.pop(did)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['stale'] = self.stale
+        return stats
+
+
+def _b64url_int(value):
+    return int.from_bytes(_b64url_bytes(value), 'big')
+
+
+def _b64url_bytes(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def load_jwk_public_key(jwk):
+    """Carga una clave pública JWK (RSA, OKP Ed25519 o EC P-256)."""
+    kty = jwk.get('kty')
+    if kty == 'RSA':
+        return rsa.RSAPublicNumbers(_b64url_int(jwk['e']), _b64url_int(jwk['n'])).public_key()
+    if kty == 'OKP' and jwk.get('crv') == 'Ed25519':
+        return ed25519.Ed25519PublicKey.from_public_bytes(_b64url_bytes(jwk['x']))
+    if kty == 'EC' and jwk.get('crv') == 'P-256':
+        return ec.EllipticCurvePublicNumbers(
+            _b64url_int(jwk['x']), _b64url_int(jwk['y']), ec.SECP256R1()).public_key()
+    raise ValueError('Unsupported JWK key type')
+
+
+class ClientKeyValidator:
+    """
+    Valida claves públicas aportadas por el cliente (PEM o JWK) y las
+    normaliza a PEM SubjectPublicKeyInfo. Los resultados, válidos o no,
+    se guardan en una caché LRU por huella SHA-256 de la clave recibida,
+    así que reenviar la misma clave no repite el parseo.
+    """
+
+    def __init__(self, max_size=10000):
+        self._cache = LRUCache(max_size)
+
+    @staticmethod
+    def fingerprint(value):
+        if isinstance(value, dict):
+            value = json.dumps(value, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(str(value).encode('utf-8')).hexdigest()
+
+    def validate(self, value):
+        """
+        Devuelve `(public_pem, key_type)` o lanza ValueError con el motivo.
+        """
+        fingerprint = self.fingerprint(value)
+        result = self._cache.get(fingerprint)
+        if result is None:
+            result = self._validate(value)
+            self._cache.put(fingerprint, result)
+        if isinstance(result, str):
+            raise ValueError(result)
+        return result
+
+    @staticmethod
+    def _validate(value):
+        try:
+            if isinstance(value, str):
+                public_key = serialization.load_pem_public_key(value.encode('utf-8'))
+            elif isinstance(value, dict):
+                public_key = load_jwk_public_key(value)
+            else:
+                return 'publicKey must be a PEM string or a JWK object'
+            key_type = key_type_of(public_key)
+        except (ValueError, KeyError, TypeError) as e:
+            return f'Invalid publicKey: {e}'
+        if key_type not in KEY_TYPES:
+            return f'Unsupported key type {key_type}'
+        public_pem = public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode('utf-8')
+        return public_pem, key_type
+
+    def stats(self):
+        return self._cache.stats()
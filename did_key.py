@@ -0,0 +1,111 @@
+"""
+Identificadores did:key derivados de la clave pública.
+
+El identificador es `did:key:z<base58btc>` de la clave precedida por su
+código multicodec (varint):
+
+    Ed25519  0xed   -> ed 01  + 32 bytes de la clave
+    P-256    0x1200 -> 80 24  + punto comprimido (33 bytes)
+    RSA      0x1205 -> 85 24  + DER PKCS#1 (RSAPublicKey)
+
+Con esto el documento base de un DID se puede reconstruir a partir del
+propio identificador, sin consultar el registro.
+"""
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from did_cache import LRUCache
+from did_crypto import KEY_TYPES, key_type_of
+
+DID_KEY_PREFIX = 'did:key:z'
+
+_BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_BASE58_INDEX = {char: value for value, char in enumerate(_BASE58_ALPHABET)}
+
+_ED25519 = b'\xed\x01'
+_P256 = b'\x80\x24'
+_RSA = b'\x85\x24'
+
+_resolved_cache = LRUCache(10000)
+
+
+def base58_encode(data):
+    number = int.from_bytes(data, 'big')
+    chars = []
+    while number:
+        number, remainder = divmod(number, 58)
+        chars.append(_BASE58_ALPHABET[remainder])
+    zeros = len(data) - len(data.lstrip(b'\0'))
+    return '1' * zeros + ''.join(reversed(chars))
+
+
+def base58_decode(text):
+    number = 0
+    for char in text:
+        try:
+            number = number * 58 + _BASE58_INDEX[char]
+        except KeyError:
+            raise ValueError(f'Invalid base58 character {char!r}') from None
+    zeros = len(text) - len(text.lstrip('1'))
+    return b'\0' * zeros + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+
+
+def did_from_public_key(public_key):
+    """Identificador did:key de una clave pública ya cargada."""
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        data = _ED25519 + public_key.public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        data = _P256 + public_key.public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.CompressedPoint)
+    elif isinstance(public_key, rsa.RSAPublicKey):
+        data = _RSA + public_key.public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.PKCS1)
+    else:
+        raise ValueError('Unsupported key type')
+    return DID_KEY_PREFIX + base58_encode(data)
+
+
+def did_from_pem(public_pem):
+    return did_from_public_key(serialization.load_pem_public_key(public_pem.encode('utf-8')))
+
+
+def is_derived_did(did):
+    return isinstance(did, str) and did.startswith(DID_KEY_PREFIX)
+
+
+def _public_key_of(did):
+    data = base58_decode(did[len(DID_KEY_PREFIX):])
+    codec, key = data[:2], data[2:]
+    if codec == _ED25519:
+        return ed25519.Ed25519PublicKey.from_public_bytes(key)
+    if codec == _P256:
+        return ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), key)
+    if codec == _RSA:
+        return serialization.load_der_public_key(key)
+    raise ValueError('Unsupported multicodec')
+
+
+def resolve_did_key(did):
+    """
+    `(public_pem, key_type)` codificados en un did:key derivado, o None si
+    el DID no es de esa forma o no contiene una clave válida admitida.
+    """
+    if not is_derived_did(did):
+        return None
+    resolved = _resolved_cache.get(did)
+    if resolved is None:
+        try:
+            public_key = _public_key_of(did)
+            key_type = key_type_of(public_key)
+        except (ValueError, TypeError):
+            return None
+        if key_type not in KEY_TYPES:
+            return None
+        public_pem = public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode('utf-8')
+        resolved = (public_pem, key_type)
+        _resolved_cache.put(did, resolved)
+    return resolved
@@ -0,0 +1,168 @@
+"""
+Métricas del proveedor de DIDs en formato de texto de Prometheus.
+
+Registrar una observación solo cuesta tomar un lock y sumar en un
+histograma de cubetas fijas; el texto se genera únicamente cuando alguien
+consulta /metrics, y es entonces cuando se leen las estadísticas de los
+demás componentes (pool de claves, commits, cachés, filtro de Bloom).
+
+Las métricas son por proceso: con `serve --workers N` cada worker
+responde con las suyas.
+"""
+import bisect
+import threading
+import time
+
+# Límites superiores (segundos) de las cubetas de latencia
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histograma acumulado de Prometheus; el lock lo lleva Metrics."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.sum)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Contadores de peticiones por ruta, método y código de estado,
+    histogramas de latencia por ruta y por etapa (`stage`), y estadísticas
+    de otros componentes registradas con `register_stats`.
+    """
+
+    def __init__(self, prefix='did', buckets=DEFAULT_BUCKETS, enabled=True):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._requests = {}
+        self._latency = {}
+        self._stages = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, method, status, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latency.get((route, method))
+            if histogram is None:
+                histogram = self._latency[(route, method)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def observe_stage(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def stage(self, stage):
+        """Context manager que mide una etapa: `with metrics.stage('keygen'):`."""
+        return _StageTimer(self, stage)
+
+    def register_stats(self, name, stats, description):
+        """
+        Exporta como gauges `<prefijo>_<name>_<clave>` los valores numéricos
+        del dict que devuelve `stats()` en cada consulta.
+        """
+        self._collectors.append((f'{self.prefix}_{name}', stats, description))
+
+    def render(self):
+        """Texto de exposición de Prometheus con todas las métricas."""
+        lines = []
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = sorted((key, list(histogram.samples(
+                f'{self.prefix}_http_request_duration_seconds',
+                (('route', key[0]), ('method', key[1])))))
+                for key, histogram in self._latency.items())
+            stages = sorted((stage, list(histogram.samples(
+                f'{self.prefix}_stage_duration_seconds', (('stage', stage),))))
+                for stage, histogram in self._stages.items())
+
+        name = f'{self.prefix}_http_requests_total'
+        lines.append(f'# HELP {name} HTTP requests handled, by route, method and status.')
+        lines.append(f'# TYPE {name} counter')
+        for (route, method, status), count in requests:
+            labels = (('route', route), ('method', method), ('status', status))
+            lines.append(f'{name}{_labels(labels)} {count}')
+
+        name = f'{self.prefix}_http_request_duration_seconds'
+        lines.append(f'# HELP {name} HTTP request latency, by route and method.')
+        lines.append(f'# TYPE {name} histogram')
+        for _, samples in latency:
+            lines.extend(samples)
+
+        name = f'{self.prefix}_stage_duration_seconds'
+        lines.append(f'# HELP {name} Duration of request stages (keygen, key_load, verify, persist).')
+        lines.append(f'# TYPE {name} histogram')
+        for _, samples in stages:
+            lines.extend(samples)
+
+        for prefix, stats, description in self._collectors:
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                lines.append(f'# HELP {name} {description} ({key}).')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
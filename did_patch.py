@@ -0,0 +1,208 @@
+"""
+JSON Patch (RFC 6902) sobre documentos y entradas del registro.
+
+`/UpdateDID` recibe una lista de operaciones (`add`, `remove`, `replace`,
+`move`, `copy` y `test`) con rutas JSON Pointer (RFC 6901) y las aplica
+todas o ninguna: `apply_patch` trabaja sobre una copia y solo copia los
+contenedores que toca, así que si una operación falla el documento
+original queda intacto.
+
+`make_patch` hace lo inverso para el almacenamiento: calcula las
+operaciones que llevan de una entrada a la siguiente, de modo que el log
+guarda solo lo que cambió y no la entrada completa.
+"""
+import copy
+
+OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+
+class PatchError(ValueError):
+    """Una operación no se puede aplicar al documento."""
+
+
+def escape_token(token):
+    return token.replace('~', '~0').replace('/', '~1')
+
+
+def parse_pointer(pointer):
+    """Lista de tokens de un JSON Pointer; `''` es el documento completo."""
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchError(f'Invalid JSON Pointer {pointer!r}')
+    tokens = pointer[1:].split('/')
+    for token in tokens:
+        if '~' in token.replace('~0', '').replace('~1', ''):
+            raise PatchError(f'Invalid escape in JSON Pointer {pointer!r}')
+    return [token.replace('~1', '/').replace('~0', '~') for token in tokens]
+
+
+def invalid_patch(ops):
+    """Mensaje de error si `ops` no es un JSON Patch bien formado, o None."""
+    if not isinstance(ops, list):
+        return 'A JSON Patch must be an array of operations'
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get('op') not in OPERATIONS:
+            return f'Operation {index}: unknown or missing "op"'
+        members = ['path'] + (['from'] if op['op'] in ('move', 'copy') else [])
+        for member in members:
+            if not isinstance(op.get(member), str):
+                return f'Operation {index}: "{member}" must be a string'
+            try:
+                parse_pointer(op[member])
+            except PatchError as e:
+                return f'Operation {index}: {e}'
+        if op['op'] in ('add', 'replace', 'test') and 'value' not in op:
+            return f'Operation {index}: missing "value"'
+    return None
+
+
+def updates_to_patch(updates):
+    """Operaciones equivalentes a `dict.update(updates)` (formato legado)."""
+    return [{'op': 'add', 'path': '/' + escape_token(key), 'value': value}
+            for key, value in updates.items()]
+
+
+def _index(container, token, pointer, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchError(f'Invalid array index in {pointer!r}')
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f'Array index out of range in {pointer!r}')
+    return index
+
+
+def _key(container, token, pointer):
+    """Clave o posición existente de `token` en `container`."""
+    if isinstance(container, dict) and token in container:
+        return token
+    if isinstance(container, list):
+        return _index(container, token, pointer)
+    raise PatchError(f'Path {pointer!r} does not exist')
+
+
+def _equal(a, b, exact=False):
+    """
+    Igualdad de JSON: a diferencia de Python, `true` no es igual a `1`.
+    Con `exact` tampoco lo son `1` y `1.0`, que se serializan distinto.
+    """
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if exact and isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return type(a) is type(b) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[key], b[key], exact) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y, exact) for x, y in zip(a, b))
+    return a == b
+
+
+class _Patcher:
+    """Aplica operaciones copiando solo los contenedores de cada ruta."""
+
+    def __init__(self, document):
+        self.root = copy.copy(document)
+        self._copied = {id(self.root)}
+
+    def _own(self, parent, key):
+        child = parent[key]
+        if isinstance(child, (dict, list)) and id(child) not in self._copied:
+            child = parent[key] = copy.copy(child)
+            self._copied.add(id(child))
+        return child
+
+    def _parent(self, pointer):
+        """Contenedor (ya copiado) del último token de la ruta, y ese token."""
+        tokens = parse_pointer(pointer)
+        container = self.root
+        for token in tokens[:-1]:
+            container = self._own(container, _key(container, token, pointer))
+        return container, tokens[-1]
+
+    def get(self, pointer):
+        value = self.root
+        for token in parse_pointer(pointer):
+            value = value[_key(value, token, pointer)]
+        return value
+
+    def add(self, pointer, value):
+        if pointer == '':
+            self.root = value
+            return
+        container, token = self._parent(pointer)
+        if isinstance(container, dict):
+            container[token] = value
+        elif isinstance(container, list):
+            container.insert(_index(container, token, pointer, allow_end=True), value)
+        else:
+            raise PatchError(f'Path {pointer!r} does not exist')
+
+    def remove(self, pointer):
+        if pointer == '':
+            raise PatchError('Cannot remove the whole document')
+        container, token = self._parent(pointer)
+        key = _key(container, token, pointer)
+        value = container[key]
+        del container[key]
+        return value
+
+    def apply(self, op):
+        name, pointer = op['op'], op['path']
+        if name == 'add':
+            self.add(pointer, copy.deepcopy(op['value']))
+        elif name == 'remove':
+            self.remove(pointer)
+        elif name == 'replace':
+            if pointer:
+                self.remove(pointer)
+            self.add(pointer, copy.deepcopy(op['value']))
+        elif name == 'move':
+            source = op['from']
+            if pointer != source and pointer.startswith(source + '/'):
+                raise PatchError(f'Cannot move {source!r} into one of its children')
+            self.add(pointer, self.remove(source))
+        elif name == 'copy':
+            self.add(pointer, copy.deepcopy(self.get(op['from'])))
+        elif name == 'test':
+            if not _equal(self.get(pointer), op['value']):
+                raise PatchError(f'Test failed at {pointer!r}')
+
+
+def apply_patch(document, ops):
+    """
+    Documento resultante de aplicar `ops` a `document`, que no se modifica.
+    Lanza PatchError si alguna operación falla; las operaciones deben
+    haber pasado `invalid_patch`.
+    """
+    patcher = _Patcher(document)
+    for op in ops:
+        patcher.apply(op)
+    return patcher.root
+
+
+def make_patch(old, new, path=''):
+    """
+    Operaciones que convierten el objeto `old` en `new`. Baja a los objetos
+    anidados que cambiaron; cualquier otro valor distinto se reemplaza.
+    """
+    ops = []
+    for key in old:
+        if key not in new:
+            ops.append({'op': 'remove', 'path': f'{path}/{escape_token(key)}'})
+    for key, value in new.items():
+        pointer = f'{path}/{escape_token(key)}'
+        if key not in old:
+            ops.append({'op': 'add', 'path': pointer, 'value': value})
+            continue
+        previous = old[key]
+        # Las entradas no se modifican en el sitio: lo que no cambió es el
+        # mismo objeto y no hace falta compararlo
+        if previous is value or _equal(previous, value, exact=True):
+            continue
+        if isinstance(previous, dict) and isinstance(value, dict):
+            ops.extend(make_patch(previous, value, pointer))
+        else:
+            ops.append({'op': 'replace', 'path': pointer, 'value': value})
+    return ops
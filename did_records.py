@@ -0,0 +1,103 @@
+"""
+Formato compacto de las entradas del registro en disco.
+
+Una entrada en memoria tiene la forma legada
+
+    {"did_document": {..., "publicKey": "<PEM>"}, "public_key": "<PEM>"}
+
+con la misma clave PEM dos veces. En disco se guarda como
+
+    {"d": {... sin publicKey ...}, "k": "<DER en base64>", "p": 1}
+
+sin espacios: la clave aparece una sola vez y `p` indica que el documento
+la repetía en `publicKey`. El PEM se vuelve a generar al leer (es el
+mismo base64 partido en líneas de 64 caracteres), con una caché LRU.
+Los registros en formato legado se siguen leyendo sin cambios.
+"""
+import base64
+import binascii
+import json
+
+from did_cache import LRUCache
+
+PEM_HEADER = '-----BEGIN PUBLIC KEY-----\n'
+PEM_FOOTER = '-----END PUBLIC KEY-----\n'
+
+_pem_cache = LRUCache(10000)
+
+
+def pem_to_der_b64(pem):
+    """
+    Devuelve el DER en base64 de un PEM `PUBLIC KEY` canónico, o None si
+    el PEM no se puede reconstruir exactamente a partir de él.
+    """
+    if not pem.startswith(PEM_HEADER) or not pem.endswith(PEM_FOOTER):
+        return None
+    der_b64 = pem[len(PEM_HEADER):-len(PEM_FOOTER)].replace('\n', '')
+    try:
+        base64.b64decode(der_b64, validate=True)
+    except binascii.Error:
+        return None
+    if der_b64_to_pem(der_b64) != pem:
+        return None
+    return der_b64
+
+
+def der_b64_to_pem(der_b64):
+    pem = _pem_cache.get(der_b64)
+    if pem is None:
+        lines = [der_b64[i:i + 64] for i in range(0, len(der_b64), 64)]
+        pem = PEM_HEADER + '\n'.join(lines) + '\n' + PEM_FOOTER
+        _pem_cache.put(der_b64, pem)
+    return pem
+
+
+def pack_entry(entry):
+    """Convierte una entrada en su registro compacto (dict)."""
+    record = {key: value for key, value in entry.items()
+              if key not in ('did_document', 'public_key')}
+    document = dict(entry['did_document'])
+    public_pem = entry.get('public_key')
+    der_b64 = pem_to_der_b64(public_pem) if public_pem else None
+    if der_b64 is None:
+        if public_pem is not None:
+            record['pem'] = public_pem
+    else:
+        record['k'] = der_b64
+        if document.get('publicKey') == public_pem:
+            del document['publicKey']
+            record['p'] = 1
+    record['d'] = document
+    return record
+
+
+def unpack_entry(record):
+    """Reconstruye la entrada a partir de un registro compacto o legado."""
+    if 'did_document' in record:
+        return record
+    entry = {key: value for key, value in record.items()
+             if key not in ('d', 'k', 'p', 'pem')}
+    document = dict(record['d'])
+    if 'k' in record:
+        public_pem = der_b64_to_pem(record['k'])
+    else:
+        public_pem = record.get('pem')
+    if record.get('p'):
+        document['publicKey'] = public_pem
+    entry['did_document'] = document
+    if public_pem is not None:
+        entry['public_key'] = public_pem
+    return entry
+
+
+def encode_entry(entry):
+    """Serializa una entrada en el formato compacto (JSON sin espacios)."""
+    return json.dumps(pack_entry(entry), separators=(',', ':'))
+
+
+def decode_entry(text):
+    return unpack_entry(json.loads(text))
+
+
+def pem_cache_stats():
+    return _pem_cache.stats()
@@ -0,0 +1,168 @@
+"""
+Modo seguidor: réplica de lectura del registro de DIDs.
+
+El seguidor arranca con el snapshot del primario (`GET /snapshot`) y
+después sigue su flujo ordenado de cambios (`GET /changes` como SSE, con
+las entradas incluidas), que aplica sobre un ReplicaStore en memoria. Los
+números de secuencia son los del primario, así que un cliente puede pedir
+leer sus propias escrituras con `minSeq`.
+
+Si la conexión se corta se reanuda desde el último cambio aplicado; si el
+primario ya no conserva esos cambios (410 o evento `gone`) se vuelve a
+cargar el snapshot.
+"""
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class SnapshotRequired(Exception):
+    """El primario ya no tiene los cambios pedidos: hay que recargar."""
+
+
+class Follower:
+    """
+    Hilo que replica el registro de `primary_url` en `store`.
+    `on_bootstrap(dids)` se llama tras cargar un snapshot y
+    `on_change(did)` tras aplicar cada cambio, para invalidar cachés.
+    """
+
+    def __init__(self, primary_url, store, on_bootstrap=None, on_change=None,
+                 timeout=60.0, retry_interval=1.0):
+        self.primary_url = primary_url.rstrip('/')
+        self.store = store
+        self.on_bootstrap = on_bootstrap
+        self.on_change = on_change
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.bootstrapped = False
+        self.connected = False
+        self.primary_seq = 0
+        self.bootstraps = 0
+        self.reconnects = 0
+        self.last_error = None
+        # Última vez que se supo al día con el primario y último mensaje
+        self._caught_up_at = None
+        self._contact_at = None
+        self._started = time.monotonic()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='did-follower', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # El hilo puede estar bloqueado leyendo del socket; es daemon y
+        # termina al vencer el timeout o con el proceso
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if not self.bootstrapped:
+                    self._bootstrap()
+                self._tail()
+            except SnapshotRequired:
+                self.bootstrapped = False
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                self.last_error = str(e)
+                self.reconnects += 1
+            self.connected = False
+            self._stopping.wait(self.retry_interval)
+
+    def _open(self, path, params, accept):
+        url = f'{self.primary_url}{path}?{urllib.parse.urlencode(params)}'
+        request = urllib.request.Request(url, headers={'Accept': accept})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _bootstrap(self):
+        with self._open('/snapshot', {}, 'application/x-ndjson') as response:
+            lines = iter(response)
+            seq = json.loads(next(lines))['seq']
+            items = []
+            for line in lines:
+                record = json.loads(line)
+                items.append((record['did'], record['entry']))
+        self.store.bootstrap(seq, items)
+        self.bootstrapped = True
+        self.bootstraps += 1
+        # La numeración del primario puede haber empezado de nuevo
+        self.primary_seq = seq
+        self._seen(seq)
+        if self.on_bootstrap is not None:
+            self.on_bootstrap([did for did, _ in items])
+
+    def _tail(self):
+        params = {'since': self.store.last_change(), 'entries': 1}
+        try:
+            response = self._open('/changes', params, 'text/event-stream')
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                raise SnapshotRequired() from e
+            raise
+        with response:
+            self.connected = True
+            event, data = 'message', []
+            for raw in response:
+                line = raw.decode('utf-8').rstrip('\r\n')
+                if not line:
+                    if data:
+                        self._dispatch(event, '\n'.join(data))
+                    event, data = 'message', []
+                    continue
+                if line.startswith(':'):
+                    continue
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+                if self._stopping.is_set():
+                    return
+
+    def _dispatch(self, event, data):
+        payload = json.loads(data)
+        if event == 'change':
+            if payload.get('entry') is not None:
+                self.store.apply(payload['seq'], payload['did'], payload['entry'])
+                if self.on_change is not None:
+                    self.on_change(payload['did'])
+            self._seen(payload['seq'])
+        elif event == 'head':
+            self._seen(payload['lastSeq'])
+        elif event == 'gone':
+            raise SnapshotRequired()
+
+    def _seen(self, primary_seq):
+        now = time.monotonic()
+        self._contact_at = now
+        self.primary_seq = max(self.primary_seq, primary_seq)
+        if self.store.last_change() >= self.primary_seq:
+            self._caught_up_at = now
+
+    def status(self):
+        """Estado de la replicación para /ReplicationStatus y /metrics."""
+        now = time.monotonic()
+        seq = self.store.last_change()
+        caught_up = self.bootstrapped and seq >= self.primary_seq
+        since = self._caught_up_at if self._caught_up_at is not None else self._started
+        return {
+            'role': 'follower',
+            'primary': self.primary_url,
+            'connected': self.connected,
+            'seq': seq,
+            'primarySeq': self.primary_seq,
+            'lagSeq': max(self.primary_seq - seq, 0),
+            # Tiempo desde la última vez que se supo al día (0 si lo está)
+            'lagSeconds': 0.0 if caught_up else now - since,
+            'lastContactSeconds': now - self._contact_at if self._contact_at is not None else None,
+            'bootstraps': self.bootstraps,
+            'reconnects': self.reconnects,
+            'lastError': self.last_error,
+        }
@@ -0,0 +1,1750 @@
+"""
+Persistencia del registro de DIDs.
+
+Las rutas de la API solo usan la interfaz RegistryStore (`get`, `exists`,
+`put`, `find`), con tres implementaciones:
+
+- JSONFileStore: modo legado, reescribe `did_registry.json` completo en
+  cada mutación.
+- LogStore: agrega un registro compacto por mutación a un log de solo
+  escritura al final y, en segundo plano, lo compacta en un snapshot.
+  Al arrancar se reconstruye el registro con el snapshot más la cola del
+  log, e importa el `did_registry.json` legado si aún no hay snapshot.
+  En modo lazy arranca sin parsear el snapshot: lo mapea en memoria y
+  parsea cada documento la primera vez que se pide.
+- SQLiteStore: base SQLite en modo WAL, compartible entre procesos y
+  sin cargar el registro en memoria.
+
+Cada escritura de un DID recibe un número de secuencia creciente, y los
+últimos cambios se pueden consultar con `changes_since` (y esperar con
+`wait_for_change`) para invalidar cachés de forma incremental.
+
+El historial de versiones de cada DID (did_versions) se guarda aparte de
+las entradas: en un archivo de solo agregar (json y log) o en la tabla
+`did_versions` (sqlite).
+
+Todos mantienen índices secundarios por controller, name y purpose, que
+se actualizan en cada escritura y permiten listar DIDs por esos campos
+(`find`) con paginación por cursor.
+
+El log, el snapshot y SQLite guardan las entradas en el formato compacto
+de did_records (la clave una sola vez, como DER). `python did_storage.py
+migrate` convierte un registro existente.
+
+Todos escriben a través de una CommitQueue con tres niveles de
+durabilidad: `fsync` (un fsync por petición), `group` (las mutaciones
+que llegan dentro de una ventana se escriben con un único fsync) y
+`buffered` (se delega en el buffer del sistema operativo).
+"""
+import base64
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from did_cache import LRUCache
+from did_patch import apply_patch
+from did_records import decode_entry, encode_entry, pack_entry, unpack_entry
+from did_versions import is_checkpoint
+
+DURABILITY_LEVELS = ('fsync', 'group', 'buffered')
+
+# Campos del DID Document con índice secundario (ver RegistryStore.find)
+INDEXED_FIELDS = ('controller', 'name', 'purpose')
+
+
+class UpdateConflict(Exception):
+    """Otra escritura cambió la entrada después de que se leyó."""
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CommitStats:
+    """Latencia de commit y tamaño de lote acumulados por la cola."""
+
+    def __init__(self, level):
+        self.level = level
+        self.commits = 0
+        self.batches = 0
+        self.records = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.batch_size_max = 0
+        self._lock = threading.Lock()
+
+    def record(self, latencies, batch_size):
+        with self._lock:
+            self.commits += len(latencies)
+            self.batches += 1
+            self.records += batch_size
+            self.latency_total += sum(latencies)
+            self.latency_max = max(self.latency_max, max(latencies))
+            self.batch_size_max = max(self.batch_size_max, batch_size)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'level': self.level,
+                'commits': self.commits,
+                'batches': self.batches,
+                'records': self.records,
+                'latency_seconds_total': self.latency_total,
+                'latency_seconds_max': self.latency_max,
+                'batch_size_avg': self.records / self.batches if self.batches else 0.0,
+                'batch_size_max': self.batch_size_max,
+            }
+
+
+class _Ticket:
+    __slots__ = ('records', 'enqueued', 'done', 'error', 'results')
+
+    def __init__(self, records):
+        self.records = records
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.error = None
+        self.results = None
+
+
+class CommitQueue:
+    """
+    Cola de commit. `enqueue` debe llamarse en el orden de las mutaciones
+    y `wait` bloquea hasta que el registro es durable según el nivel.
+
+    `flush(records, durable)` escribe los registros y hace fsync si
+    `durable` es verdadero. Si devuelve una lista (un valor por registro),
+    `wait` devuelve a cada ticket la parte que le corresponde.
+    """
+
+    def __init__(self, flush, level='buffered', window_ms=5):
+        if level not in DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability level: {level}')
+        self.level = level
+        self.window = window_ms / 1000.0
+        self.stats = CommitStats(level)
+        self._flush = flush
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._writer = None
+        if level == 'group':
+            self._writer = threading.Thread(target=self._run, daemon=True)
+            self._writer.start()
+
+    def enqueue(self, record):
+        return self.enqueue_many([record])
+
+    def enqueue_many(self, records):
+        """Encola varios registros que se confirman en el mismo commit."""
+        ticket = _Ticket(records)
+        if self.level != 'group':
+            self._commit([ticket], durable=self.level == 'fsync')
+            return ticket
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Commit queue is closed')
+            self._pending.append(ticket)
+            self._cond.notify()
+        return ticket
+
+    def wait(self, ticket):
+        ticket.done.wait()
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.results
+
+    def _commit(self, batch, durable):
+        records = [record for ticket in batch for record in ticket.records]
+        try:
+            results = self._flush(records, durable)
+        except Exception as e:
+            for ticket in batch:
+                ticket.error = e
+        else:
+            if results is not None:
+                start = 0
+                for ticket in batch:
+                    ticket.results = results[start:start + len(ticket.records)]
+                    start += len(ticket.records)
+        now = time.perf_counter()
+        self.stats.record([now - t.enqueued for t in batch], len(records))
+        for ticket in batch:
+            ticket.done.set()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Esperar el resto de la ventana para agrupar más mutaciones
+                deadline = self._pending[0].enqueued + self.window
+                while not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, []
+            self._commit(batch, durable=True)
+
+    def close(self):
+        """Escribe lo pendiente y detiene el hilo escritor."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._writer is not None:
+            self._writer.join()
+
+
+class ChangeLog:
+    """
+    Números de secuencia de los cambios de un almacén en memoria: cada
+    escritura de un DID recibe el siguiente. Se conservan los últimos
+    `retention` cambios para `since`, y `wait` bloquea hasta que haya
+    alguno nuevo.
+    """
+
+    def __init__(self, retention=100000):
+        self.retention = retention
+        self.last = 0
+        # _dids[i] es el DID del cambio _first + i
+        self._first = 1
+        self._dids = []
+        self._cond = threading.Condition()
+
+    def reset(self, seq):
+        """Continúa la numeración tras `seq`, sin historial anterior."""
+        with self._cond:
+            self.last = seq
+            self._first = seq + 1
+            self._dids = []
+            self._cond.notify_all()
+
+    def append(self, dids):
+        """Registra los cambios de `dids` y devuelve sus números de secuencia."""
+        with self._cond:
+            first = self.last + 1
+            self._dids.extend(dids)
+            self.last += len(dids)
+            self._trim()
+            self._cond.notify_all()
+        return list(range(first, first + len(dids)))
+
+    def _trim(self):
+        # Se recorta por bloques para que el coste quede amortizado
+        excess = len(self._dids) - self.retention
+        if excess > self.retention // 2:
+            del self._dids[:excess]
+            self._first += excess
+
+    def restore(self, seq, did):
+        """Reaplica un cambio ya numerado (al reconstruir desde el log)."""
+        with self._cond:
+            if seq <= self.last:
+                return
+            if seq != self.last + 1:
+                self._first = seq
+                self._dids = []
+            self._dids.append(did)
+            self.last = seq
+            self._trim()
+            self._cond.notify_all()
+
+    def since(self, seq, limit=None):
+        """
+        Lista `[(seq, did)]` de los cambios posteriores a `seq`, o None si
+        parte de ellos ya no se conserva (o `seq` es de otra numeración).
+        """
+        with self._cond:
+            if seq > self.last or seq < self._first - 1:
+                return None
+            start = seq + 1 - self._first
+            end = len(self._dids) if limit is None else min(len(self._dids), start + limit)
+            return [(self._first + i, self._dids[i]) for i in range(start, end)]
+
+    def wait(self, seq, timeout):
+        """Espera a que haya un cambio posterior a `seq`; False si vence `timeout`."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.last > seq, timeout)
+
+
+def index_values(entry):
+    """
+    Valores de INDEXED_FIELDS en el documento de la entrada. Solo se
+    indexan cadenas; cualquier otro valor (o su ausencia) queda como None.
+    """
+    document = entry['did_document']
+    return tuple(value if isinstance(value, str) else None
+                 for value in (document.get(field) for field in INDEXED_FIELDS))
+
+
+class SecondaryIndex:
+    """
+    Índices secundarios en memoria sobre INDEXED_FIELDS: para cada valor,
+    la lista ordenada de los DIDs que lo tienen. Se mantienen al escribir
+    cada entrada, de modo que una consulta solo recorre la lista más corta
+    de las que intervienen, a partir del cursor.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._postings = {field: {} for field in INDEXED_FIELDS}
+        self._lock = threading.Lock()
+
+    def update(self, did, values):
+        with self._lock:
+            old = self._values.get(did)
+            if old == values:
+                return
+            self._values[did] = values
+            for field, old_value, value in zip(INDEXED_FIELDS, old or (None,) * len(values), values):
+                if old_value == value:
+                    continue
+                postings = self._postings[field]
+                if old_value is not None:
+                    dids = postings[old_value]
+                    del dids[bisect.bisect_left(dids, did)]
+                    if not dids:
+                        del postings[old_value]
+                if value is not None:
+                    bisect.insort(postings.setdefault(value, []), did)
+
+    def values(self, did):
+        return self._values.get(did, (None,) * len(INDEXED_FIELDS))
+
+    def find(self, filters, after=None, limit=100):
+        with self._lock:
+            lists = []
+            for field, value in filters.items():
+                dids = self._postings[field].get(value)
+                if dids is None:
+                    return []
+                lists.append(dids)
+            # Se recorre la lista más corta y el resto de filtros se
+            # comprueban con los valores del DID
+            dids = min(lists, key=len)
+            checks = [(INDEXED_FIELDS.index(field), value) for field, value in filters.items()]
+            start = bisect.bisect_right(dids, after) if after is not None else 0
+            found = []
+            for position in range(start, len(dids)):
+                did = dids[position]
+                values = self._values[did]
+                if all(values[column] == value for column, value in checks):
+                    found.append(did)
+                    if len(found) == limit:
+                        break
+            return found
+
+    def stats(self):
+        with self._lock:
+            stats = {'dids': len(self._values)}
+            for field in INDEXED_FIELDS:
+                stats[f'{field}_values'] = len(self._postings[field])
+            return stats
+
+
+class VersionLog:
+    """
+    Historial de versiones de los almacenes en memoria (ver did_versions).
+    Se persiste en un archivo aparte de solo agregar, con una línea JSON
+    compacta por versión (`{"did", "v", "r"}`); los registros no cambian,
+    así que ni guardar el registro ni compactarlo reescriben el historial.
+
+    En memoria solo queda un índice, como el `.idx` del snapshot:
+    `index[did][i]` describe la versión `i + 1` con su fecha, si es un
+    checkpoint y dónde está su línea (`(offset, longitud)`). Los registros
+    se leen del archivo al pedirlos. Hasta que se escriben, y siempre sin
+    archivo (réplicas), el índice guarda el registro mismo.
+
+    `add` actualiza el índice y deja las líneas pendientes, y el almacén
+    llama a `write` en su commit antes de escribir la entrada: una entrada
+    durable no apunta nunca a versiones que no lo son. Si tras una caída
+    entre ambos pasos se vuelve a escribir una versión, reemplaza a la
+    guardada y a las que la siguen.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.index = {}
+        self._pending = []
+        self._file = None
+        self._fd = None
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+
+    def load(self):
+        """Indexa el archivo; descarta una última línea truncada."""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        good_offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    break
+                self._store(item['did'], item['v'], item['r'], (good_offset, len(line)))
+                good_offset += len(line)
+        if good_offset < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_offset)
+
+    def _store(self, did, version, record, location):
+        history = self.index.setdefault(did, [])
+        if version <= len(history) + 1:
+            del history[version - 1:]
+            history.append((record['t'], is_checkpoint(record), location))
+
+    def add(self, did, versions):
+        """Añade los registros `[(versión, registro)]` de `did`."""
+        with self._lock:
+            for version, record in versions:
+                self._store(did, version, record, record)
+                if self.path is not None:
+                    line = _dumps({'did': did, 'v': version, 'r': record}) + '\n'
+                    self._pending.append((did, version, record, line.encode()))
+
+    def write(self, durable):
+        """Escribe las líneas pendientes; lo llama el commit del almacén."""
+        # Bajo _file_lock para que dos commits no inviertan el orden
+        with self._file_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            offset = self._file.seek(0, os.SEEK_END)
+            self._file.write(b''.join(line for *_, line in pending))
+            self._file.flush()
+            if durable:
+                os.fsync(self._file.fileno())
+            with self._lock:
+                for did, version, record, line in pending:
+                    history = self.index.get(did, ())
+                    # Salvo que otra escritura la haya reemplazado entretanto
+                    if version <= len(history) and history[version - 1][2] is record:
+                        history[version - 1] = history[version - 1][:2] + ((offset, len(line)),)
+                    offset += len(line)
+
+    def _read(self, location):
+        if isinstance(location, dict):
+            return location
+        offset, length = location
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDONLY)
+            fd = self._fd
+        return json.loads(os.pread(fd, length, offset))['r']
+
+    def since_checkpoint(self, did, version):
+        with self._lock:
+            history = self.index.get(did, ())
+            if not 1 <= version <= len(history):
+                return []
+            start = version - 1
+            while not history[start][1]:
+                start -= 1
+            locations = [location for _, _, location in history[start:version]]
+        return [self._read(location) for location in locations]
+
+    def version_at(self, did, timestamp, upto):
+        history = self.index.get(did, ())[:upto]
+        return bisect.bisect_right([t for t, _, _ in history], timestamp) or None
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+
+    def close(self):
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class RegistryStore:
+    """
+    Interfaz de almacenamiento que usan las rutas de la API. Las entradas
+    tienen la forma `{"did_document": {...}, "public_key": "<PEM>"}` y se
+    tratan como inmutables: `put` siempre recibe la entrada completa.
+    """
+
+    def load(self):
+        """Prepara el almacén (lectura inicial, esquema, importación)."""
+
+    def get(self, did):
+        """Devuelve la entrada del DID o None si no existe."""
+        raise NotImplementedError
+
+    def exists(self, did):
+        return self.get(did) is not None
+
+    def get_many(self, dids):
+        """Devuelve `{did: entry}` con los DIDs que existen."""
+        entries = {}
+        for did in dids:
+            entry = self.get(did)
+            if entry is not None:
+                entries[did] = entry
+        return entries
+
+    def exists_many(self, dids):
+        """Devuelve el conjunto de DIDs que existen."""
+        return {did for did in dids if self.exists(did)}
+
+    def iter_dids(self):
+        """Itera todos los DIDs registrados (para reconstruir índices)."""
+        raise NotImplementedError
+
+    def find(self, filters, after=None, limit=100):
+        """
+        Hasta `limit` DIDs, en orden, posteriores a `after` y cuyo documento
+        tiene todos los valores de `filters` (`{campo: valor}` sobre
+        INDEXED_FIELDS, al menos uno). Usa los índices secundarios, nunca
+        recorre el registro completo.
+        """
+        raise NotImplementedError
+
+    def put(self, did, entry):
+        """
+        Crea o reemplaza la entrada; retorna, cuando es durable, el número
+        de secuencia del cambio.
+        """
+        return self.put_many([(did, entry)])[0]
+
+    def put_many(self, items):
+        """
+        Escribe varias entradas `(did, entry)` en un único commit y devuelve
+        sus números de secuencia, en orden.
+        """
+        raise NotImplementedError
+
+    def update(self, did, entry, patch, versions=()):
+        """
+        Reemplaza la entrada de un DID existente por `entry`; `patch` son
+        las operaciones JSON Patch (did_patch) que llevan de la entrada
+        guardada a `entry`. Los almacenes que pueden persisten solo el
+        parche. `versions` son los registros `[(versión, registro)]` que
+        la actualización añade al historial del DID (did_versions), que se
+        guarda aparte de la entrada en el mismo commit. Retorna el número
+        de secuencia, como `put`.
+
+        Los almacenes compartidos entre procesos lanzan UpdateConflict si
+        la versión guardada ya no es la anterior a la de `entry`; quien
+        llama debe releer la entrada y reintentar.
+        """
+        raise NotImplementedError
+
+    def version_records(self, did, version):
+        """
+        Registros del historial de `did` desde el checkpoint más cercano
+        anterior o igual a `version` hasta esa versión, en orden (ver
+        did_versions.rebuild); lista vacía si no se guardó.
+        """
+        raise NotImplementedError
+
+    def version_at(self, did, timestamp, upto):
+        """
+        Última versión de `did`, como mucho `upto`, creada no después de
+        `timestamp` (ms), o None.
+        """
+        raise NotImplementedError
+
+    def last_change(self):
+        """Número de secuencia del último cambio confirmado (0 si ninguno)."""
+        raise NotImplementedError
+
+    def changes_since(self, seq, limit=None):
+        """
+        Lista `[(seq, did)]` de los cambios posteriores a `seq`, o None si
+        parte de ellos ya no se conserva.
+        """
+        raise NotImplementedError
+
+    def wait_for_change(self, seq, timeout):
+        """Bloquea hasta que haya un cambio posterior a `seq` o venza `timeout`."""
+        raise NotImplementedError
+
+    def commit_stats(self):
+        return self._queue.stats.as_dict()
+
+    def after_fork(self):
+        """
+        Prepara el almacén en un proceso hijo creado con fork: los hilos
+        del padre (el de commit en grupo) no existen en el hijo y sus locks
+        pueden haber quedado tomadas. Solo SQLite admite además varios
+        procesos a la vez.
+        """
+
+    def close(self):
+        pass
+
+    def __contains__(self, did):
+        return self.exists(did)
+
+
+class _InMemoryStore(RegistryStore):
+    """Base de los almacenes que mantienen el registro completo en un dict."""
+
+    def get(self, did):
+        return self.data.get(did)
+
+    def exists(self, did):
+        return did in self.data
+
+    def iter_dids(self):
+        return iter(list(self.data))
+
+    def find(self, filters, after=None, limit=100):
+        return self.index.find(filters, after, limit)
+
+    def _index_entries(self, items):
+        for did, entry in items:
+            self.index.update(did, index_values(entry))
+
+    def index_stats(self):
+        return self.index.stats()
+
+    def last_change(self):
+        return self.changes.last
+
+    def changes_since(self, seq, limit=None):
+        return self.changes.since(seq, limit)
+
+    def wait_for_change(self, seq, timeout):
+        return self.changes.wait(seq, timeout)
+
+    def version_records(self, did, version):
+        return self.versions.since_checkpoint(did, version)
+
+    def version_at(self, did, timestamp, upto):
+        return self.versions.version_at(did, timestamp, upto)
+
+
+class JSONFileStore(_InMemoryStore):
+    """
+    Registro en memoria persistido como un único archivo JSON.
+
+    Con commit en grupo, todas las mutaciones de un lote se cubren con una
+    sola reescritura del archivo. El historial de versiones va en su
+    propio archivo (VersionLog).
+    """
+
+    def __init__(self, path, durability='buffered', group_commit_ms=5,
+                 changes_retention=100000, versions_path=None):
+        self.path = path
+        self.data = {}
+        self.versions = VersionLog(versions_path)
+        self.index = SecondaryIndex()
+        # El último número de secuencia va en un archivo aparte, para que
+        # la numeración de /changes continúe tras un reinicio
+        self.seq_path = path + '.seq'
+        self.changes = ChangeLog(changes_retention)
+        self._lock = threading.RLock()
+        self._queue = CommitQueue(self._flush, durability, group_commit_ms)
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        if os.path.exists(self.seq_path):
+            with open(self.seq_path, 'r') as f:
+                self.changes.reset(int(f.read()))
+        self._index_entries(self.data.items())
+        self.versions.load()
+        return self.data
+
+    def put_many(self, items):
+        with self._lock:
+            self.data.update(items)
+            self._index_entries(items)
+            seqs = self.changes.append([did for did, _ in items])
+            ticket = self._queue.enqueue_many([did for did, _ in items])
+        self._queue.wait(ticket)
+        return seqs
+
+    def update(self, did, entry, patch, versions=()):
+        self.versions.add(did, versions)
+        return self.put(did, entry)
+
+    def _flush(self, records, durable):
+        self.versions.write(durable)
+        with self._lock:
+            text = json.dumps(self.data, indent=4)
+            seq = self.changes.last
+        # La secuencia se escribe antes que los datos: tras un corte puede
+        # saltarse números, pero nunca repetir uno ya entregado
+        self._replace(self.seq_path, str(seq), durable)
+        self._replace(self.path, text, durable)
+
+    @staticmethod
+    def _replace(path, text, durable):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if durable:
+            _fsync_dir(path)
+
+    def after_fork(self):
+        self._lock = threading.RLock()
+        self.versions.after_fork()
+        self._queue = CommitQueue(self._flush, self._queue.level, self._queue.window * 1000)
+
+    def close(self):
+        self._queue.close()
+        self.versions.close()
+
+
+class ReplicaStore(_InMemoryStore):
+    """
+    Copia en memoria del registro de un primario (modo seguidor, ver
+    did_replica). No admite escrituras de la API: las entradas llegan con
+    `bootstrap` y `apply`, con los números de secuencia del primario, así
+    que `changes_since` y `last_change` reflejan su numeración.
+    """
+
+    def __init__(self, changes_retention=100000):
+        self.data = {}
+        self.index = SecondaryIndex()
+        self.changes = ChangeLog(changes_retention)
+        # El historial de versiones no se replica: queda vacío
+        self.versions = VersionLog()
+        self._lock = threading.Lock()
+
+    def put_many(self, items):
+        raise RuntimeError('Replica stores are read-only')
+
+    def update(self, did, entry, patch, versions=()):
+        raise RuntimeError('Replica stores are read-only')
+
+    def bootstrap(self, seq, items):
+        """Reemplaza todo el contenido por el snapshot `items` tomado en `seq`."""
+        data = dict(items)
+        index = SecondaryIndex()
+        for did, entry in data.items():
+            index.update(did, index_values(entry))
+        with self._lock:
+            self.data = data
+            self.index = index
+            self.changes.reset(seq)
+
+    def apply(self, seq, did, entry):
+        """Aplica un cambio del primario."""
+        with self._lock:
+            self.data[did] = entry
+            self.index.update(did, index_values(entry))
+            self.changes.restore(seq, did)
+
+    def commit_stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class LogStore(_InMemoryStore):
+    """
+    Registro persistido como snapshot + log de mutaciones.
+
+    El snapshot tiene una línea por DID (`<did>\\t<registro compacto>`) y
+    el log una línea JSON compacta por mutación (ver did_records). Las entradas se tratan como
+    inmutables: cada mutación reemplaza la entrada completa, lo que permite
+    compactar sin bloquear las escrituras.
+
+    Con `lazy=True` el snapshot no se carga: se construye (o se lee de
+    `<snapshot>.idx`) un índice DID -> offset, el archivo se mapea en
+    memoria y cada entrada se parsea la primera vez que se pide, quedando
+    en una caché LRU. `data` contiene entonces solo la cola del log y las
+    mutaciones posteriores al último snapshot. El índice guarda también los
+    valores de INDEXED_FIELDS de cada línea, para montar los índices
+    secundarios sin parsear el snapshot.
+
+    Cada registro del log lleva su número de secuencia (`s`) y la cabecera
+    del índice el del snapshot, así que la numeración de los cambios
+    sobrevive a los reinicios y los de la cola del log siguen disponibles
+    para `changes_since`.
+
+    `update` escribe un registro `patch` con solo las operaciones JSON
+    Patch del cambio, que al arrancar se aplican sobre la entrada
+    anterior. Como un parche no se puede aplicar dos veces, al reproducir
+    el log se saltan los registros que el snapshot ya incluye (secuencia
+    menor o igual que la suya).
+
+    El historial de versiones va en su propio archivo (VersionLog), que
+    la compactación no toca.
+    """
+
+    def __init__(self, snapshot_path, log_path, legacy_path=None,
+                 compact_threshold=10000, durability='buffered',
+                 group_commit_ms=5, lazy=False, cache_size=10000,
+                 changes_retention=100000, versions_path=None):
+        self.snapshot_path = snapshot_path
+        self.index_path = snapshot_path + '.idx'
+        self.log_path = log_path
+        self.rotated_log_path = log_path + '.compacting'
+        self.legacy_path = legacy_path
+        self.compact_threshold = compact_threshold
+        self.lazy = lazy
+        self.data = {}
+        self.index = SecondaryIndex()
+        self.changes = ChangeLog(changes_retention)
+        self.versions = VersionLog(versions_path)
+        # Índice y mapa del snapshot; se reemplazan juntos al compactar
+        self._snapshot = ({}, None)
+        self._cache = LRUCache(cache_size if lazy else 0)
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._log = None
+        self._log_records = 0
+        self._compactor = None
+        self._queue = CommitQueue(self._flush, durability, group_commit_ms)
+
+    def load(self):
+        """Reconstruye el registro a partir del snapshot y la cola del log."""
+        has_log = (os.path.exists(self.log_path)
+                   or os.path.exists(self.rotated_log_path))
+        if (not os.path.exists(self.snapshot_path) and not has_log
+                and self.legacy_path and os.path.exists(self.legacy_path)):
+            # Importación transparente del registro legado
+            with open(self.legacy_path, 'r') as f:
+                self._write_snapshot(json.load(f), seq=0)
+
+        if os.path.exists(self.snapshot_path):
+            self.changes.reset(self._snapshot_seq())
+            if self.lazy:
+                values = {}
+                self._snapshot = self._open_snapshot(values)
+                for did, row in values.items():
+                    self.index.update(did, row)
+            else:
+                self._read_snapshot()
+
+        # Un log rotado indica una compactación interrumpida
+        if os.path.exists(self.rotated_log_path):
+            self._replay(self.rotated_log_path)
+        if os.path.exists(self.log_path):
+            self._log_records = self._replay(self.log_path)
+        self._index_entries(self.data.items())
+        self.versions.load()
+
+        self._log = open(self.log_path, 'a')
+        return self.data
+
+    def _read_snapshot(self):
+        with open(self.snapshot_path, 'r') as f:
+            for line in f:
+                did, _, entry = line.rstrip('\n').partition('\t')
+                self.data[did] = decode_entry(entry)
+
+    def _open_snapshot(self, values=None):
+        """
+        Mapea el snapshot y carga (o reconstruye) su índice de offsets. Si
+        se pasa `values`, se llena con los valores indexados de cada DID.
+        """
+        values = {} if values is None else values
+        with open(self.snapshot_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return {}, None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index = self._read_index(values)
+        if index is None:
+            # Sin índice, o de una versión sin valores: hay que parsear
+            index = {}
+            values.clear()
+            offset = 0
+            while offset < size:
+                end = mm.find(b'\n', offset)
+                if end < 0:
+                    end = size
+                tab = mm.find(b'\t', offset, end)
+                did = mm[offset:tab].decode('utf-8')
+                index[did] = offset
+                values[did] = index_values(decode_entry(mm[tab + 1:end]))
+                offset = end + 1
+            self._write_index(index, size, values, self.changes.last)
+        return index, mm
+
+    def _index_file(self):
+        """
+        Índice que corresponde al snapshot actual, o None. Si la escritura
+        del snapshot se interrumpió justo después de reemplazarlo, el suyo
+        es todavía el `.idx.tmp`.
+        """
+        size = str(os.path.getsize(self.snapshot_path))
+        for path in (self.index_path, self.index_path + '.tmp'):
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    header = f.readline().split()
+                if header[:1] == [size]:
+                    return path, int(header[1]) if len(header) > 1 else 0
+        return None
+
+    def _snapshot_seq(self):
+        """Secuencia del último cambio incluido en el snapshot (0 si no consta)."""
+        found = self._index_file()
+        return found[1] if found is not None else 0
+
+    def _read_index(self, values):
+        found = self._index_file()
+        if found is None:
+            return None
+        index = {}
+        with open(found[0], 'r') as f:
+            f.readline()
+            for line in f:
+                try:
+                    did, offset, row = line.rstrip('\n').split('\t')
+                except ValueError:
+                    return None
+                index[did] = int(offset)
+                values[did] = tuple(json.loads(row))
+        return index
+
+    def _write_index(self, index, snapshot_size, values, seq, replace=True):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f'{snapshot_size} {seq}\n')
+            for did, offset in index.items():
+                f.write(f'{did}\t{offset}\t{_dumps(values[did])}\n')
+        if replace:
+            os.replace(tmp_path, self.index_path)
+
+    def _replay(self, path):
+        """Aplica los registros del log; descarta una última línea truncada."""
+        count = 0
+        good_offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                # Los registros anteriores a la numeración no traen `s`
+                seq = record.get('s', self.changes.last + 1)
+                if seq > self.changes.last:
+                    self._replay_record(record)
+                    self.changes.restore(seq, record['did'])
+                good_offset += len(line)
+                count += 1
+        if good_offset < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+        return count
+
+    def _replay_record(self, record):
+        did = record['did']
+        if record['op'] == 'put':
+            if 'r' in record:
+                self.data[did] = unpack_entry(record['r'])
+            else:
+                self.data[did] = record['entry']
+        elif record['op'] == 'patch':
+            self.data[did] = apply_patch(self.get(did), record['p'])
+
+    def get(self, did):
+        entry = self.data.get(did)
+        if entry is not None or not self.lazy:
+            return entry
+        entry = self._cache.get(did)
+        if entry is not None:
+            return entry
+        index, mm = self._snapshot
+        offset = index.get(did)
+        if offset is None:
+            return None
+        end = mm.find(b'\n', offset)
+        line = mm[offset:end if end >= 0 else len(mm)]
+        entry = decode_entry(line[line.index(b'\t') + 1:])
+        self._cache.put(did, entry)
+        return entry
+
+    def exists(self, did):
+        return did in self.data or did in self._snapshot[0]
+
+    def iter_dids(self):
+        overlay = list(self.data)
+        yield from overlay
+        overlay = set(overlay)
+        for did in list(self._snapshot[0]):
+            if did not in overlay:
+                yield did
+
+    def put_many(self, items):
+        packed = [(did, pack_entry(entry)) for did, entry in items]
+        with self._lock:
+            for did, entry in items:
+                self.data[did] = entry
+                self._cache.pop(did)
+            self._index_entries(items)
+            seqs = self.changes.append([did for did, _ in items])
+            records = [_dumps({'op': 'put', 'did': did, 's': seq, 'r': record})
+                       for (did, record), seq in zip(packed, seqs)]
+            ticket = self._queue.enqueue_many(records)
+            self._log_records += len(records)
+            if self._log_records >= self.compact_threshold:
+                self._start_compaction()
+        self._queue.wait(ticket)
+        return seqs
+
+    def update(self, did, entry, patch, versions=()):
+        with self._lock:
+            self.versions.add(did, versions)
+            self.data[did] = entry
+            self._cache.pop(did)
+            self._index_entries([(did, entry)])
+            seq = self.changes.append([did])[0]
+            ticket = self._queue.enqueue(_dumps({'op': 'patch', 'did': did, 's': seq, 'p': patch}))
+            self._log_records += 1
+            if self._log_records >= self.compact_threshold:
+                self._start_compaction()
+        self._queue.wait(ticket)
+        return seq
+
+    def _flush(self, records, durable):
+        self.versions.write(durable)
+        with self._file_lock:
+            self._log.write(''.join(record + '\n' for record in records))
+            self._log.flush()
+            if durable:
+                os.fsync(self._log.fileno())
+
+    def _start_compaction(self):
+        """Rota el log y escribe el snapshot en un hilo de fondo."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        # Los registros encolados antes de rotar pueden acabar en el log
+        # nuevo; reaplicarlos sobre el snapshot es inocuo.
+        with self._file_lock:
+            self._log.close()
+            if not os.path.exists(self.rotated_log_path):
+                os.replace(self.log_path, self.rotated_log_path)
+            else:
+                # Una compactación anterior falló: su log rotado se conserva
+                # hasta que el nuevo snapshot quede escrito.
+                with open(self.log_path, 'r') as src, \
+                        open(self.rotated_log_path, 'a') as dst:
+                    dst.write(src.read())
+                os.remove(self.log_path)
+            self._log = open(self.log_path, 'a')
+        self._log_records = 0
+        state = dict(self.data)
+        self._compactor = threading.Thread(
+            target=self._compact, args=(state, self.changes.last), daemon=True)
+        self._compactor.start()
+
+    def _compact(self, state, seq):
+        self._write_snapshot(state, self._snapshot if self.lazy else None, seq)
+        if self.lazy:
+            snapshot = self._open_snapshot()
+            with self._lock:
+                self._snapshot = snapshot
+                # Lo que ya está en el snapshot deja de ocupar memoria; la
+                # caché se vacía para no servir líneas del snapshot anterior
+                for did, entry in state.items():
+                    if self.data.get(did) is entry:
+                        del self.data[did]
+                self._cache.clear()
+        os.remove(self.rotated_log_path)
+
+    def _write_snapshot(self, state, base=None, seq=0):
+        """
+        Escribe `state`, que incluye los cambios hasta `seq`, como snapshot.
+        En modo lazy, `base` es el snapshot anterior, cuyas líneas sin
+        cambios se copian sin parsearlas.
+        """
+        index = {}
+        values = {}
+        offset = 0
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            if base is not None:
+                base_index, mm = base
+                for did, start in base_index.items():
+                    if did in state:
+                        continue
+                    end = mm.find(b'\n', start)
+                    line = mm[start:end if end >= 0 else len(mm)] + b'\n'
+                    f.write(line)
+                    index[did] = offset
+                    values[did] = self.index.values(did)
+                    offset += len(line)
+            for did, entry in state.items():
+                line = (did + '\t' + encode_entry(entry) + '\n').encode('utf-8')
+                f.write(line)
+                index[did] = offset
+                values[did] = index_values(entry)
+                offset += len(line)
+            f.flush()
+            os.fsync(f.fileno())
+        # El índice queda escrito antes de reemplazar el snapshot, para no
+        # perder su secuencia si el proceso se interrumpe entre ambos pasos
+        self._write_index(index, offset, values, seq, replace=False)
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_dir(self.snapshot_path)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def compact(self):
+        """Compacta de forma síncrona (útil en mantenimiento y pruebas)."""
+        with self._lock:
+            self._start_compaction()
+            compactor = self._compactor
+        compactor.join()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        # Una compactación en curso en el padre no continúa en el hijo; su
+        # log rotado se conserva y se incorpora en la siguiente
+        self._compactor = None
+        self.versions.after_fork()
+        self._queue = CommitQueue(self._flush, self._queue.level, self._queue.window * 1000)
+
+    def close(self):
+        self._queue.close()
+        self.versions.close()
+        with self._lock:
+            compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._file_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+
+class SQLiteStore(RegistryStore):
+    """
+    Registro en una base SQLite (módulo estándar `sqlite3`) en modo WAL.
+
+    Las lecturas toman una conexión de un pool de como mucho `readers`
+    conexiones y la devuelven al terminar, así que el número de conexiones
+    no crece con el de hilos del servidor. Las consultas usan SQL
+    constante, de modo que la caché de sentencias de cada conexión sirve
+    sentencias ya preparadas. Las escrituras pasan por la CommitQueue: con
+    commit en grupo, cada lote es una única transacción.
+
+    Varios procesos pueden compartir la base. Cada escritura anota además
+    el DID en `did_changes`, en la misma transacción, con un número de
+    secuencia creciente; así cada proceso sabe qué cambiaron los demás
+    (`changes_since`). Se conservan las últimas `changes_retention` filas.
+    Las locks de un proceso no protegen de los demás, así que `update`
+    comprueba en esa transacción que la versión guardada sea la que se
+    leyó (compare-and-swap) y, si no, lanza UpdateConflict.
+
+    El historial de versiones está en `did_versions`, una fila por versión
+    escrita en la misma transacción que la entrada.
+
+    Los índices secundarios son índices de SQLite sobre `(campo, did)`:
+    `find` lee directamente la página pedida, ya en orden de DID.
+    """
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS dids ('
+        ' did TEXT PRIMARY KEY,'
+        ' controller TEXT,'
+        ' name TEXT,'
+        ' purpose TEXT,'
+        ' entry TEXT NOT NULL,'
+        ' key BLOB)',
+        'CREATE TABLE IF NOT EXISTS did_changes ('
+        ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' did TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS did_versions ('
+        ' did TEXT NOT NULL,'
+        ' version INTEGER NOT NULL,'
+        ' t INTEGER NOT NULL,'
+        ' record TEXT NOT NULL,'
+        ' PRIMARY KEY (did, version)) WITHOUT ROWID',
+    )
+    # Se crean después de añadir las columnas que falten en bases antiguas;
+    # sustituyen a los índices de una sola columna
+    _INDEXES = (
+        'DROP INDEX IF EXISTS dids_controller',
+        'DROP INDEX IF EXISTS dids_name',
+    ) + tuple(f'CREATE INDEX IF NOT EXISTS dids_by_{field} ON dids ({field}, did)'
+              for field in INDEXED_FIELDS)
+    _SELECT_ENTRY = 'SELECT entry, key FROM dids WHERE did = ?'
+    _SELECT_EXISTS = 'SELECT 1 FROM dids WHERE did = ?'
+    # Lotes de tamaño fijo para reutilizar la sentencia preparada; el
+    # último se rellena repitiendo DIDs
+    _MANY_CHUNK = 100
+    _SELECT_MANY = ('SELECT did, entry, key FROM dids WHERE did IN ('
+                    + ','.join('?' * _MANY_CHUNK) + ')')
+    _SELECT_MANY_EXISTS = ('SELECT did FROM dids WHERE did IN ('
+                           + ','.join('?' * _MANY_CHUNK) + ')')
+    _UPSERT = ('INSERT OR REPLACE INTO dids (did, controller, name, purpose, entry, key)'
+               ' VALUES (?, ?, ?, ?, ?, ?)')
+    _SELECT_VERSION = "SELECT COALESCE(json_extract(entry, '$.version'), 1) FROM dids WHERE did = ?"
+    _INSERT_CHANGE = 'INSERT INTO did_changes (did) VALUES (?)'
+    _INSERT_VERSION = 'INSERT OR REPLACE INTO did_versions (did, version, t, record) VALUES (?, ?, ?, ?)'
+    # Desde el último checkpoint (registro con `c`) hasta la versión pedida
+    _SELECT_VERSIONS = ('SELECT record FROM did_versions WHERE did = ?1 AND version <= ?2'
+                        ' AND version >= (SELECT MAX(version) FROM did_versions'
+                        "  WHERE did = ?1 AND version <= ?2 AND json_type(record, '$.c') IS NOT NULL)"
+                        ' ORDER BY version')
+    _SELECT_VERSION_AT = 'SELECT MAX(version) FROM did_versions WHERE did = ? AND version <= ? AND t <= ?'
+    # LIMIT -1 es sin límite en SQLite
+    _SELECT_CHANGES = 'SELECT seq, did FROM did_changes WHERE seq > ? ORDER BY seq LIMIT ?'
+    _PRUNE_CHANGES = 'DELETE FROM did_changes WHERE seq <= ?'
+    # Cada cuántos commits se recorta did_changes
+    _PRUNE_EVERY = 1000
+    # Las escrituras de otros procesos no avisan: wait_for_change consulta
+    # la base con este intervalo (segundos)
+    _CHANGE_POLL_INTERVAL = 0.1
+
+    def __init__(self, path, legacy_path=None, durability='buffered',
+                 group_commit_ms=5, changes_retention=100000, readers=8):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.changes_retention = changes_retention
+        self.readers = readers
+        self._flushes = 0
+        self._readers = self._reader_pool()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._writer = None
+        self._queue = CommitQueue(self._flush, durability, group_commit_ms)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                               isolation_level=None, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # En modo WAL, NORMAL no sincroniza en cada commit
+        synchronous = 'NORMAL' if self._queue.level == 'buffered' else 'FULL'
+        conn.execute(f'PRAGMA synchronous={synchronous}')
+        return conn
+
+    def _reader_pool(self):
+        # None es un hueco libre: la conexión se abre al usarlo por primera vez
+        pool = queue.Queue(self.readers)
+        for _ in range(self.readers):
+            pool.put(None)
+        return pool
+
+    @contextlib.contextmanager
+    def _reader(self):
+        """Conexión de lectura del pool; espera si están todas en uso."""
+        conn = self._readers.get()
+        try:
+            if conn is None:
+                conn = self._connect()
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def load(self):
+        is_new = not os.path.exists(self.path)
+        self._writer = self._connect()
+        for statement in self._SCHEMA:
+            self._writer.execute(statement)
+        columns = {row[1] for row in self._writer.execute('PRAGMA table_info(dids)')}
+        if 'key' not in columns:
+            # Bases anteriores al formato compacto: sus filas se siguen
+            # leyendo y se convierten al reescribirse
+            self._writer.execute('ALTER TABLE dids ADD COLUMN key BLOB')
+        if 'purpose' not in columns:
+            self._writer.execute('ALTER TABLE dids ADD COLUMN purpose TEXT')
+            self._backfill_purpose()
+        for statement in self._INDEXES:
+            self._writer.execute(statement)
+        if is_new and self.legacy_path and os.path.exists(self.legacy_path):
+            # Importación transparente del registro legado
+            with open(self.legacy_path, 'r') as f:
+                legacy = json.load(f)
+            self._flush(list(legacy.items()), durable=True)
+
+    def _backfill_purpose(self):
+        """Rellena la columna purpose, añadida después, en una transacción."""
+        rows = self._writer.execute('SELECT did, entry, key FROM dids').fetchall()
+        updates = [(index_values(self._decode(entry, key))[INDEXED_FIELDS.index('purpose')], did)
+                   for did, entry, key in rows]
+        self._writer.execute('BEGIN IMMEDIATE')
+        try:
+            self._writer.executemany('UPDATE dids SET purpose = ? WHERE did = ?', updates)
+        except Exception:
+            self._writer.execute('ROLLBACK')
+            raise
+        self._writer.execute('COMMIT')
+
+    def get(self, did):
+        with self._reader() as conn:
+            row = conn.execute(self._SELECT_ENTRY, (did,)).fetchone()
+        return self._decode(*row) if row else None
+
+    def exists(self, did):
+        with self._reader() as conn:
+            return conn.execute(self._SELECT_EXISTS, (did,)).fetchone() is not None
+
+    @staticmethod
+    def _encode(entry):
+        """Registro compacto sin la clave, y la clave como DER binario."""
+        record = pack_entry(entry)
+        der_b64 = record.pop('k', None)
+        key = base64.b64decode(der_b64) if der_b64 else None
+        return _dumps(record), key
+
+    @staticmethod
+    def _decode(text, key):
+        record = json.loads(text)
+        if key is not None:
+            record['k'] = base64.b64encode(key).decode('ascii')
+        return unpack_entry(record)
+
+    def _select_many(self, sql, dids):
+        dids = list(dids)
+        rows = []
+        with self._reader() as conn:
+            for start in range(0, len(dids), self._MANY_CHUNK):
+                chunk = dids[start:start + self._MANY_CHUNK]
+                chunk += chunk[-1:] * (self._MANY_CHUNK - len(chunk))
+                rows.extend(conn.execute(sql, chunk))
+        return rows
+
+    def iter_dids(self):
+        # La conexión queda prestada mientras se recorre
+        with self._reader() as conn:
+            yield from (row[0] for row in conn.execute('SELECT did FROM dids'))
+
+    def get_many(self, dids):
+        return {did: self._decode(entry, key)
+                for did, entry, key in self._select_many(self._SELECT_MANY, dids)}
+
+    def exists_many(self, dids):
+        return {row[0] for row in self._select_many(self._SELECT_MANY_EXISTS, dids)}
+
+    def find(self, filters, after=None, limit=100):
+        # El SQL depende solo de qué campos se filtran, así que también
+        # sale preparado de la caché de sentencias
+        fields = [field for field in INDEXED_FIELDS if field in filters]
+        where = ' AND '.join([f'{field} = ?' for field in fields] + ['did > ?'])
+        sql = f'SELECT did FROM dids WHERE {where} ORDER BY did LIMIT ?'
+        params = [filters[field] for field in fields] + [after or '', limit]
+        with self._reader() as conn:
+            return [row[0] for row in conn.execute(sql, params)]
+
+    def put_many(self, items):
+        with self._lock:
+            ticket = self._queue.enqueue_many(list(items))
+        return self._queue.wait(ticket)
+
+    def update(self, did, entry, patch, versions=()):
+        # Compare-and-swap sobre `version` dentro de la transacción del
+        # lote: otro proceso pudo actualizar el DID después de leerlo
+        with self._lock:
+            ticket = self._queue.enqueue((did, entry, entry.get('version', 1) - 1, versions))
+        seq = self._queue.wait(ticket)[0]
+        if seq is None:
+            raise UpdateConflict(did)
+        return seq
+
+    def _check_versions(self, records):
+        """
+        Qué registros del lote se escriben: los de `update` (con versión
+        esperada) solo si la versión guardada, o la que deja un registro
+        anterior del mismo lote, es esa.
+        """
+        versions = {}
+        accepted = []
+        for did, entry, *expected in records:
+            if expected:
+                if did in versions:
+                    current = versions[did]
+                else:
+                    row = self._writer.execute(self._SELECT_VERSION, (did,)).fetchone()
+                    current = row[0] if row else None
+                if current != expected[0]:
+                    accepted.append(False)
+                    continue
+            versions[did] = entry.get('version', 1)
+            accepted.append(True)
+        return accepted
+
+    def version_records(self, did, version):
+        with self._reader() as conn:
+            rows = conn.execute(self._SELECT_VERSIONS, (did, version)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def version_at(self, did, timestamp, upto):
+        with self._reader() as conn:
+            return conn.execute(self._SELECT_VERSION_AT, (did, upto, timestamp)).fetchone()[0]
+
+    def _flush(self, records, durable):
+        # Solo escribe el hilo del lote (group) o quien tiene self._lock
+        self._writer.execute('BEGIN IMMEDIATE')
+        try:
+            accepted = self._check_versions(records)
+            rows = [(record[0],) + index_values(record[1]) + self._encode(record[1])
+                    for record, ok in zip(records, accepted) if ok]
+            self._writer.executemany(self._UPSERT, rows)
+            self._writer.executemany(self._INSERT_CHANGE, [(row[0],) for row in rows])
+            self._writer.executemany(self._INSERT_VERSION, [
+                (record[0], number, version['t'], _dumps(version))
+                for record, ok in zip(records, accepted) if ok and len(record) > 3
+                for number, version in record[3]])
+            # La transacción tiene el lock de escritura, así que los números
+            # de secuencia del lote son consecutivos
+            last = self._writer.execute('SELECT MAX(seq) FROM did_changes').fetchone()[0] or 0
+            self._flushes += 1
+            if self._flushes % self._PRUNE_EVERY == 0:
+                self._writer.execute(self._PRUNE_CHANGES, (last - self.changes_retention,))
+        except Exception:
+            self._writer.execute('ROLLBACK')
+            raise
+        self._writer.execute('COMMIT')
+        with self._changed:
+            self._changed.notify_all()
+        # None para los registros rechazados por el compare-and-swap
+        seqs = iter(range(last - len(rows) + 1, last + 1))
+        return [next(seqs) if ok else None for ok in accepted]
+
+    def last_change(self):
+        """Número de secuencia del último cambio confirmado (0 si ninguno)."""
+        with self._reader() as conn:
+            row = conn.execute('SELECT MAX(seq) FROM did_changes').fetchone()
+        return row[0] or 0
+
+    def changes_since(self, seq, limit=None):
+        """
+        Lista `[(seq, did)]` de los cambios confirmados después de `seq`,
+        por cualquier proceso, o None si parte de ellos ya se recortó.
+        """
+        with self._reader() as conn:
+            # Las consultas en la misma transacción de lectura, por si otro
+            # proceso recorta la tabla entre una y otra
+            conn.execute('BEGIN')
+            try:
+                first, last = conn.execute('SELECT MIN(seq), MAX(seq) FROM did_changes').fetchone()
+                if seq > (last or 0) or (first is not None and first > seq + 1):
+                    return None
+                return conn.execute(self._SELECT_CHANGES,
+                                    (seq, -1 if limit is None else limit)).fetchall()
+            finally:
+                conn.execute('COMMIT')
+
+    def wait_for_change(self, seq, timeout):
+        deadline = time.monotonic() + timeout
+        while self.last_change() <= seq:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._changed:
+                self._changed.wait(min(remaining, self._CHANGE_POLL_INTERVAL))
+        return True
+
+    def after_fork(self):
+        # Las conexiones y el hilo de commit del padre no sirven en el hijo
+        self._readers = self._reader_pool()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._queue = CommitQueue(self._flush, self._queue.level, self._queue.window * 1000)
+        self._writer = self._connect()
+
+    def close(self):
+        self._queue.close()
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class _SharedIdempotencySlot:
+    __slots__ = ('cache', 'key', 'fingerprint', 'response')
+
+    def __init__(self, cache, key, fingerprint, response=None):
+        self.cache = cache
+        self.key = key
+        self.fingerprint = fingerprint
+        self.response = response
+
+    def wait(self, timeout):
+        """
+        Espera a que la petición dueña, quizá de otro proceso, termine;
+        False si vence `timeout`. Si la clave se liberó, `response` queda
+        en None y quien llama vuelve a reservarla.
+        """
+        if self.response is not None:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            row = self.cache.row(self.key)
+            if row is None or row[0] != self.fingerprint:
+                return True
+            if row[1] is not None:
+                self.response = self.cache.decode(self.key, row[1])
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.cache.POLL_INTERVAL)
+
+
+class SQLiteIdempotencyCache:
+    """
+    IdempotencyCache (did_cache) compartida por los procesos de `serve` en
+    una base SQLite. La tabla `idempotency_keys` tiene una fila por clave
+    con la huella de la petición, la respuesta guardada (NULL mientras la
+    petición dueña sigue en curso) y su caducidad. La clave es única y se
+    reserva en una transacción, así que un solo worker genera el DID; los
+    demás consultan la fila hasta que tenga respuesta.
+
+    Las respuestas llevan la clave privada del DID: se guardan cifradas
+    con AES-GCM bajo una clave (`key`, aleatoria por omisión) que solo
+    existe en memoria. `serve` crea la caché en el padre antes del fork,
+    así que la comparten los workers y se pierde al parar el servidor; las
+    filas de una ejecución anterior ya no se pueden leer y se borran al
+    empezar.
+
+    Una reserva en curso caduca a los `lease` segundos, para que la clave
+    no quede bloqueada si su worker muere. Una fila caducada se borra en
+    cuanto se consulta; las que nadie vuelve a pedir, y las más antiguas
+    por encima de `max_size`, cada `_PURGE_EVERY` reservas. Los contadores
+    son de cada proceso.
+    """
+
+    _SCHEMA = ('CREATE TABLE IF NOT EXISTS idempotency_keys ('
+               ' key TEXT PRIMARY KEY,'
+               ' fingerprint TEXT NOT NULL,'
+               ' response BLOB,'
+               ' expires REAL NOT NULL)')
+    _INDEX = 'CREATE INDEX IF NOT EXISTS idempotency_keys_by_expires ON idempotency_keys (expires)'
+    _SELECT = 'SELECT fingerprint, response, expires FROM idempotency_keys WHERE key = ?'
+    _INSERT = ('INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, response, expires)'
+               ' VALUES (?, ?, NULL, ?)')
+    _COMPLETE = ('UPDATE idempotency_keys SET response = ?, expires = ?'
+                 ' WHERE key = ? AND fingerprint = ? AND response IS NULL')
+    _RELEASE = 'DELETE FROM idempotency_keys WHERE key = ? AND fingerprint = ? AND response IS NULL'
+    _EXPIRE = 'DELETE FROM idempotency_keys WHERE key = ? AND expires <= ?'
+    _PURGE = 'DELETE FROM idempotency_keys WHERE expires <= ?'
+    _EVICT = ('DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys'
+              ' WHERE response IS NOT NULL ORDER BY expires LIMIT ?)')
+    _PURGE_EVERY = 1000
+    # Intervalo (segundos) con el que se consulta una reserva en curso
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, max_size, ttl, lease, key=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lease = lease
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._claims = 0
+        self._aead = AESGCM(key or AESGCM.generate_key(bit_length=256))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute(self._SCHEMA)
+        conn.execute(self._INDEX)
+        conn.execute('DELETE FROM idempotency_keys')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30,
+                                                      isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def encode(self, key, response):
+        # La clave de idempotencia va como dato asociado: una respuesta
+        # cifrada no se puede pasar por la de otra clave
+        nonce = os.urandom(12)
+        return nonce + self._aead.encrypt(nonce, _dumps(list(response)).encode(), key.encode())
+
+    def decode(self, key, data):
+        try:
+            text = self._aead.decrypt(data[:12], data[12:], key.encode())
+        except InvalidTag:
+            raise ValueError(f'Corrupt idempotency response for {key!r}') from None
+        body, status, headers = json.loads(text)
+        return body, status, headers
+
+    def row(self, key):
+        """Fila de `key`, o None si no existe o ha caducado (y entonces se borra)."""
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(self._SELECT, (key,)).fetchone()
+        if row is not None and row[2] <= now:
+            if conn.execute(self._EXPIRE, (key, now)).rowcount:
+                with self._lock:
+                    self.expirations += 1
+            return None
+        return row
+
+    def claim(self, key, fingerprint):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(self._SELECT, (key,)).fetchone()
+            expired = row is not None and row[2] <= now
+            if row is None or expired:
+                # INSERT OR REPLACE sustituye la fila caducada
+                conn.execute(self._INSERT, (key, fingerprint, now + self.lease))
+            purged, evicted = self._purge(conn, now)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        owner = row is None or expired
+        with self._lock:
+            self.expirations += purged + expired
+            self.evictions += evicted
+            if owner:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if owner:
+            return _SharedIdempotencySlot(self, key, fingerprint), True
+        response = self.decode(key, row[1]) if row[1] is not None else None
+        return _SharedIdempotencySlot(self, key, row[0], response), False
+
+    def _purge(self, conn, now):
+        """Cada `_PURGE_EVERY` reservas, borra las filas caducadas y las que sobran."""
+        with self._lock:
+            self._claims += 1
+            if self._claims % self._PURGE_EVERY:
+                return 0, 0
+        purged = conn.execute(self._PURGE, (now,)).rowcount
+        excess = conn.execute('SELECT COUNT(*) FROM idempotency_keys').fetchone()[0] - self.max_size
+        evicted = conn.execute(self._EVICT, (excess,)).rowcount if excess > 0 else 0
+        return purged, evicted
+
+    def complete(self, slot, response):
+        slot.response = response
+        self._conn().execute(self._COMPLETE, (self.encode(slot.key, response),
+                                              time.time() + self.ttl, slot.key, slot.fingerprint))
+
+    def release(self, slot):
+        """Libera la clave sin guardar respuesta; quien espera lo reintenta."""
+        self._conn().execute(self._RELEASE, (slot.key, slot.fingerprint))
+
+    def after_fork(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        size = self._conn().execute('SELECT COUNT(*) FROM idempotency_keys').fetchone()[0]
+        with self._lock:
+            return {
+                'size': size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def open_store(kind, registry_file, log_file=None, snapshot_file=None,
+               compact_threshold=10000, durability='buffered',
+               group_commit_ms=5, sqlite_file=None, lazy=False,
+               cache_size=10000, changes_retention=100000, versions_file=None,
+               sqlite_readers=8):
+    """
+    Crea el almacén configurado (`json`, `log` o `sqlite`) y lo carga.
+    """
+    base, _ = os.path.splitext(registry_file)
+    if kind == 'json':
+        store = JSONFileStore(registry_file, durability, group_commit_ms,
+                              changes_retention=changes_retention,
+                              versions_path=versions_file or base + '.versions')
+    elif kind == 'log':
+        store = LogStore(snapshot_file or base + '.snapshot',
+                         log_file or base + '.log',
+                         legacy_path=registry_file,
+                         compact_threshold=compact_threshold,
+                         durability=durability,
+                         group_commit_ms=group_commit_ms,
+                         lazy=lazy, cache_size=cache_size,
+                         changes_retention=changes_retention,
+                         versions_path=versions_file or base + '.versions')
+    elif kind == 'sqlite':
+        store = SQLiteStore(sqlite_file or base + '.sqlite3',
+                            legacy_path=registry_file,
+                            durability=durability,
+                            group_commit_ms=group_commit_ms,
+                            changes_retention=changes_retention,
+                            readers=sqlite_readers)
+    else:
+        raise ValueError(f'Unknown storage kind: {kind}')
+    store.load()
+    return store
+
+
+def migrate(kind, registry_file, **options):
+    """
+    Convierte el almacén `kind` al formato compacto: importa el
+    `did_registry.json` legado si hace falta y reescribe todas las entradas.
+    """
+    options['lazy'] = False
+    store = open_store(kind, registry_file, **options)
+    try:
+        if kind == 'log':
+            store.compact()
+        elif kind == 'sqlite':
+            dids = list(store.iter_dids())
+            for start in range(0, len(dids), 1000):
+                store.put_many(list(store.get_many(dids[start:start + 1000]).items()))
+        else:
+            raise ValueError('Only the log and sqlite stores use the compact format')
+        return len(list(store.iter_dids()))
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Registry storage maintenance')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subcommands.add_parser(
+        'migrate', help='Rewrite a registry in the compact record format')
+    migrate_parser.add_argument('--storage', choices=('log', 'sqlite'), required=True)
+    migrate_parser.add_argument('--registry', default='did_registry.json')
+    migrate_parser.add_argument('--log-file')
+    migrate_parser.add_argument('--snapshot-file')
+    migrate_parser.add_argument('--sqlite-file')
+    args = parser.parse_args()
+
+    count = migrate(args.storage, args.registry, log_file=args.log_file,
+                    snapshot_file=args.snapshot_file, sqlite_file=args.sqlite_file)
+    print(f'Migrated {count} DIDs to the compact {args.storage} format')
@@ -0,0 +1,147 @@
+"""
+Historial de versiones de los DID Documents.
+
+Una entrada que nunca se actualizó es la versión 1 y solo lleva la fecha
+de creación (`created`, en milisegundos desde epoch). Cada actualización
+incrementa `version` y anota su fecha en `updated`. La entrada guarda
+solo el documento actual: el registro de cada versión se guarda aparte en
+el almacén (ver RegistryStore.update), así que una actualización escribe
+un registro pequeño y no reescribe el historial:
+
+    {"t": <ms>, "c": {...documento completo...}}     checkpoint
+    {"t": <ms>, "d": {"s": {...}, "u": [...]}}       delta
+
+El delta lista los campos de primer nivel que cambiaron (`s`) o se
+quitaron (`u`) respecto a la versión anterior. La versión 1 (que se
+guarda en la primera actualización) y cada `checkpoint_interval`
+versiones se guarda el documento completo, así que reconstruir una
+versión aplica como mucho ese número de deltas, sin recorrer todo el
+historial. Como en did_records, un checkpoint omite `publicKey` si
+coincide con la clave registrada (`p`).
+"""
+import calendar
+import time
+from datetime import datetime, timezone
+
+from did_patch import _equal
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def format_time(ms):
+    """Fecha ISO 8601 en UTC y sin fracciones de segundo (DID Core)."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ms // 1000))
+
+
+def parse_time(text):
+    """Milisegundos desde epoch de una fecha ISO 8601 (UTC si no lleva zona)."""
+    moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return calendar.timegm(moment.utctimetuple()) * 1000 + moment.microsecond // 1000
+
+
+def diff(old, new):
+    delta = {}
+    changed = {key: value for key, value in new.items()
+               if key not in old or not _equal(old[key], value, exact=True)}
+    removed = [key for key in old if key not in new]
+    if changed:
+        delta['s'] = changed
+    if removed:
+        delta['u'] = removed
+    return delta
+
+
+def apply_delta(document, delta):
+    document = dict(document)
+    document.update(delta.get('s', {}))
+    for key in delta.get('u', ()):
+        document.pop(key, None)
+    return document
+
+
+def current_version(entry):
+    return entry.get('version', 1)
+
+
+def last_updated(entry):
+    """Fecha de la versión actual (None en entradas anteriores al historial)."""
+    return entry.get('updated', entry.get('created'))
+
+
+def effective_time(timestamp):
+    """
+    Las fechas se publican sin fracciones de segundo, así que una versión
+    cuenta como vigente durante todo el segundo en que se creó: se busca
+    hasta el final del segundo de `timestamp` (ms).
+    """
+    return timestamp // 1000 * 1000 + 999
+
+
+def is_checkpoint(record):
+    return 'c' in record
+
+
+def _checkpoint(document, public_pem, timestamp):
+    record = {'t': timestamp}
+    if public_pem is not None and document.get('publicKey') == public_pem:
+        record['c'] = {key: value for key, value in document.items() if key != 'publicKey'}
+        record['p'] = 1
+    else:
+        record['c'] = document
+    return record
+
+
+def record_update(entry, did_document, checkpoint_interval, timestamp=None):
+    """
+    Entrada nueva con `did_document` como versión siguiente, y la lista
+    `[(versión, registro)]` que hay que añadir al historial guardado; la
+    primera actualización añade también la versión 1 como checkpoint.
+    """
+    timestamp = now_ms() if timestamp is None else timestamp
+    public_pem = entry.get('public_key')
+    version = current_version(entry) + 1
+    records = []
+    if version == 2:
+        records.append((1, _checkpoint(entry['did_document'], public_pem,
+                                       entry.get('created', 0))))
+    if (version - 1) % checkpoint_interval == 0:
+        records.append((version, _checkpoint(did_document, public_pem, timestamp)))
+    else:
+        records.append((version, {'t': timestamp,
+                                  'd': diff(entry['did_document'], did_document)}))
+    entry = dict(entry, did_document=did_document, version=version, updated=timestamp)
+    return entry, records
+
+
+def rebuild(records, public_pem):
+    """
+    Documento de la última versión de `records`, que empiezan por un
+    checkpoint y siguen con los deltas de las versiones siguientes (ver
+    RegistryStore.version_records).
+    """
+    document = dict(records[0]['c'])
+    if records[0].get('p'):
+        document['publicKey'] = public_pem
+    for record in records[1:]:
+        document = apply_delta(document, record['d'])
+    return document
+
+
+def metadata(entry, version=None, updated=None):
+    """
+    DID Document Metadata (versionId, created, updated) de la versión
+    actual, o de la versión anterior `version` creada en `updated`.
+    """
+    if version is None:
+        version, updated = current_version(entry), last_updated(entry)
+    result = {'versionId': str(version)}
+    created = entry.get('created')
+    if created is not None:
+        result['created'] = format_time(created)
+    if version > 1 and updated is not None:
+        result['updated'] = format_time(updated)
+    return result
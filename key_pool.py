@@ -0,0 +1,170 @@
+"""
+Pool acotado de pares de claves pre-generados.
+
+Los pares se generan en procesos de fondo para que /CreateDID no bloquee
+un worker durante la generación RSA. El pool se rellena hasta la marca
+alta cuando baja de la marca baja y se vacía al apagar el servidor. Los
+mismos procesos generan en paralelo los pares de /CreateDIDBatch.
+"""
+import collections
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+from did_crypto import DEFAULT_KEY_TYPE, generate_key_pair
+
+
+class KeyPairPool:
+    """
+    Mantiene entre `low_watermark` y `high_watermark` pares de claves de
+    tipo `key_type` listos. Si el pool está vacío, `acquire` genera el par
+    en línea y lo contabiliza en `fallbacks`. Los demás tipos de clave no
+    se pre-generan.
+    """
+
+    def __init__(self, low_watermark=4, high_watermark=16, workers=None,
+                 key_type=DEFAULT_KEY_TYPE):
+        if low_watermark < 0 or high_watermark < 0:
+            raise ValueError('Invalid key pool watermarks')
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.high_watermark = high_watermark
+        self.workers = workers
+        self.key_type = key_type
+        self.served = 0
+        self.fallbacks = 0
+        self._keys = collections.deque()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._closed = False
+
+    def start(self):
+        """Arranca los procesos generadores y llena el pool."""
+        with self._lock:
+            if self._closed or self._executor is not None:
+                return
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._refill()
+
+    def acquire(self, key_type=None):
+        """
+        Devuelve un par (public_pem, private_pem). Para el tipo del pool
+        solo genera en línea cuando no queda ningún par en el pool.
+        """
+        if key_type is not None and key_type != self.key_type:
+            return generate_key_pair(key_type)
+        if self._executor is None and not self._closed:
+            self.start()
+        with self._lock:
+            pair = self._keys.popleft() if self._keys else None
+            if pair is None:
+                self.fallbacks += 1
+            else:
+                self.served += 1
+        self._refill()
+        if pair is None:
+            pair = generate_key_pair(self.key_type)
+        return pair
+
+    def acquire_future(self, key_type=None):
+        """
+        Como `acquire`, pero devuelve un Future: ya resuelto si había un
+        par en el pool y, si no, el de la generación en un proceso, de modo
+        que un servidor asyncio puede esperarlo sin bloquear un hilo.
+        """
+        key_type = key_type or self.key_type
+        if self._executor is None and not self._closed:
+            self.start()
+        with self._lock:
+            pair = None
+            if key_type == self.key_type:
+                pair = self._keys.popleft() if self._keys else None
+                if pair is None:
+                    self.fallbacks += 1
+                else:
+                    self.served += 1
+            executor = self._executor
+        self._refill()
+        if pair is None and executor is not None:
+            return executor.submit(generate_key_pair, key_type)
+        future = Future()
+        future.set_result(pair if pair is not None else generate_key_pair(key_type))
+        return future
+
+    def generate(self, key_types):
+        """
+        Genera un par por cada tipo de `key_types` y entrega tuplas
+        `(posición, par)` según van estando listas: primero las que ya hay
+        en el pool y después las generadas en paralelo por los procesos.
+        """
+        if self._executor is None and not self._closed:
+            self.start()
+        ready = []
+        with self._lock:
+            for position, key_type in enumerate(key_types):
+                if not self._keys:
+                    break
+                if key_type == self.key_type:
+                    ready.append((position, self._keys.popleft()))
+            self.served += len(ready)
+            executor = self._executor
+        self._refill()
+        yield from ready
+
+        done = {position for position, _ in ready}
+        missing = [(position, key_type)
+                   for position, key_type in enumerate(key_types)
+                   if position not in done]
+        if executor is None:
+            for position, key_type in missing:
+                yield position, generate_key_pair(key_type)
+            return
+        futures = {executor.submit(generate_key_pair, key_type): position
+                   for position, key_type in missing}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _refill(self):
+        with self._lock:
+            if self._closed or self._executor is None or not self.high_watermark:
+                return
+            available = len(self._keys) + len(self._pending)
+            if available >= max(self.low_watermark, 1):
+                return
+            futures = [self._executor.submit(generate_key_pair, self.key_type)
+                       for _ in range(self.high_watermark - available)]
+            self._pending.update(futures)
+        for future in futures:
+            future.add_done_callback(self._on_generated)
+
+    def _on_generated(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if self._closed or future.cancelled() or future.exception():
+                return
+            if len(self._keys) < self.high_watermark:
+                self._keys.append(future.result())
+
+    def shutdown(self):
+        """Detiene los procesos y descarta las claves no entregadas."""
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+            pending = list(self._pending)
+            self._keys.clear()
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'available': len(self._keys),
+                'pending': len(self._pending),
+                'served': self.served,
+                'fallbacks': self.fallbacks,
+            }
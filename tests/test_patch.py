@@ -0,0 +1,169 @@
+import json
+import unittest
+
+from did_patch import (PatchError, apply_patch, escape_token, invalid_patch, make_patch,
+                       parse_pointer, updates_to_patch)
+
+
+def document():
+    return {'id': 'did:example:1', 'service': [{'id': 's1'}, {'id': 's2'}],
+            'meta': {'a/b': 1, 'm~n': 2, 'nested': {'x': 1}}}
+
+
+class ApplyPatchTest(unittest.TestCase):
+    """Cada operación de RFC 6902, con su caso válido y los que fallan."""
+
+    def setUp(self):
+        self.document = document()
+
+    def apply(self, *ops):
+        return apply_patch(self.document, list(ops))
+
+    def test_add(self):
+        self.assertEqual(self.apply({'op': 'add', 'path': '/name', 'value': 'n'})['name'], 'n')
+        self.assertEqual(self.apply({'op': 'add', 'path': '/meta/nested/x', 'value': 2})
+                         ['meta']['nested']['x'], 2)
+        service = self.apply({'op': 'add', 'path': '/service/1', 'value': {'id': 'new'}})['service']
+        self.assertEqual([item['id'] for item in service], ['s1', 'new', 's2'])
+        service = self.apply({'op': 'add', 'path': '/service/-', 'value': {'id': 'last'}})['service']
+        self.assertEqual(service[-1], {'id': 'last'})
+        self.assertEqual(self.apply({'op': 'add', 'path': '', 'value': {'id': 'x'}}), {'id': 'x'})
+        for path in ('/missing/x', '/service/3', '/service/01', '/service/x', '/id/x'):
+            with self.assertRaises(PatchError, msg=path):
+                self.apply({'op': 'add', 'path': path, 'value': 1})
+
+    def test_remove(self):
+        self.assertNotIn('meta', self.apply({'op': 'remove', 'path': '/meta'}))
+        self.assertEqual(self.apply({'op': 'remove', 'path': '/service/0'})['service'], [{'id': 's2'}])
+        for path in ('/missing', '/service/2', '/service/-', ''):
+            with self.assertRaises(PatchError, msg=path):
+                self.apply({'op': 'remove', 'path': path})
+
+    def test_replace(self):
+        self.assertEqual(self.apply({'op': 'replace', 'path': '/id', 'value': 'x'})['id'], 'x')
+        self.assertEqual(self.apply({'op': 'replace', 'path': '/service/1', 'value': 3})['service'],
+                         [{'id': 's1'}, 3])
+        self.assertEqual(self.apply({'op': 'replace', 'path': '', 'value': []}), [])
+        for path in ('/missing', '/service/2'):
+            with self.assertRaises(PatchError, msg=path):
+                self.apply({'op': 'replace', 'path': path, 'value': 1})
+
+    def test_move(self):
+        result = self.apply({'op': 'move', 'from': '/meta/nested', 'path': '/nested'})
+        self.assertEqual(result['nested'], {'x': 1})
+        self.assertNotIn('nested', result['meta'])
+        result = self.apply({'op': 'move', 'from': '/service/0', 'path': '/service/-'})
+        self.assertEqual([item['id'] for item in result['service']], ['s2', 's1'])
+        self.assertEqual(self.apply({'op': 'move', 'from': '/id', 'path': '/id'}), self.document)
+        with self.assertRaises(PatchError):
+            self.apply({'op': 'move', 'from': '/missing', 'path': '/x'})
+        # Un valor no puede moverse dentro de sí mismo
+        with self.assertRaises(PatchError):
+            self.apply({'op': 'move', 'from': '/meta', 'path': '/meta/nested/meta'})
+
+    def test_copy(self):
+        result = self.apply({'op': 'copy', 'from': '/meta/nested', 'path': '/copied'})
+        self.assertEqual(result['copied'], {'x': 1})
+        # La copia es independiente del original
+        result = apply_patch(result, [{'op': 'replace', 'path': '/copied/x', 'value': 2}])
+        self.assertEqual(result['meta']['nested']['x'], 1)
+        with self.assertRaises(PatchError):
+            self.apply({'op': 'copy', 'from': '/missing', 'path': '/x'})
+
+    def test_test(self):
+        self.assertEqual(self.apply({'op': 'test', 'path': '/meta/nested', 'value': {'x': 1}}),
+                         self.document)
+        self.apply({'op': 'test', 'path': '/meta/nested/x', 'value': 1.0})
+        # En JSON, `1` y `true` son valores distintos
+        for value in (True, '1', 2):
+            with self.assertRaises(PatchError, msg=value):
+                self.apply({'op': 'test', 'path': '/meta/nested/x', 'value': value})
+        with self.assertRaises(PatchError):
+            self.apply({'op': 'test', 'path': '/missing', 'value': None})
+
+    def test_escaped_tokens(self):
+        result = self.apply({'op': 'replace', 'path': '/meta/a~1b', 'value': 10},
+                            {'op': 'remove', 'path': '/meta/m~0n'})
+        self.assertEqual(result['meta'], {'a/b': 10, 'nested': {'x': 1}})
+        self.assertEqual(parse_pointer('/a~1b/m~0n/~01'), ['a/b', 'm~n', '~1'])
+        self.assertEqual(escape_token('a/~b'), 'a~1~0b')
+        with self.assertRaises(PatchError):
+            parse_pointer('/a~2')
+        with self.assertRaises(PatchError):
+            parse_pointer('a')
+
+    def test_all_or_nothing(self):
+        original = document()
+        with self.assertRaises(PatchError):
+            self.apply({'op': 'add', 'path': '/name', 'value': 'n'},
+                       {'op': 'remove', 'path': '/service/0'},
+                       {'op': 'replace', 'path': '/meta/nested/x', 'value': 2},
+                       {'op': 'test', 'path': '/id', 'value': 'other'})
+        self.assertEqual(self.document, original)
+
+    def test_does_not_modify_the_input(self):
+        original = document()
+        result = self.apply({'op': 'add', 'path': '/meta/nested/y', 'value': 2},
+                            {'op': 'add', 'path': '/service/-', 'value': {'id': 's3'}})
+        self.assertEqual(self.document, original)
+        # Lo que no se tocó se comparte con el original
+        self.assertIs(result['id'], self.document['id'])
+        self.assertIs(result['service'][0], self.document['service'][0])
+
+
+class InvalidPatchTest(unittest.TestCase):
+
+    def test_well_formed(self):
+        self.assertIsNone(invalid_patch([]))
+        self.assertIsNone(invalid_patch([{'op': 'move', 'from': '/a', 'path': '/b'},
+                                         {'op': 'add', 'path': '/c', 'value': None}]))
+
+    def test_malformed(self):
+        for ops in ({'op': 'add'},
+                    [{'op': 'merge', 'path': '/a'}],
+                    [{'path': '/a'}],
+                    [{'op': 'remove'}],
+                    [{'op': 'remove', 'path': 'a'}],
+                    [{'op': 'remove', 'path': '/a~'}],
+                    [{'op': 'copy', 'path': '/a'}],
+                    [{'op': 'replace', 'path': '/a'}],
+                    [{'op': 'test', 'path': '/a'}]):
+            self.assertIsNotNone(invalid_patch(ops), ops)
+
+
+class MakePatchTest(unittest.TestCase):
+    """Las operaciones de make_patch, aplicadas a la entrada anterior, dan la nueva."""
+
+    def assertReplays(self, old, new):
+        ops = make_patch(old, new)
+        self.assertIsNone(invalid_patch(ops))
+        result = apply_patch(old, ops)
+        self.assertEqual(result, new)
+        # También el tipo de cada valor (`1` no es `1.0` ni `true`)
+        self.assertEqual(json.dumps(result, sort_keys=True), json.dumps(new, sort_keys=True))
+        return ops
+
+    def test_replays(self):
+        old = document()
+        self.assertEqual(self.assertReplays(old, document()), [])
+        new = document()
+        new['meta']['nested']['x'] = 2
+        new['meta']['a/b'] = [1]
+        del new['meta']['m~n']
+        new['service'].append({'id': 's3'})
+        new['name'] = 'n'
+        del new['id']
+        self.assertReplays(old, new)
+
+    def test_type_changes(self):
+        self.assertReplays({'n': 1}, {'n': True})
+        self.assertReplays({'n': 1}, {'n': 1.0})
+        self.assertReplays({'n': [1]}, {'n': [1.0]})
+
+    def test_updates_to_patch(self):
+        ops = updates_to_patch({'name': 'n', 'a/b': 1})
+        self.assertEqual(apply_patch(document(), ops)['a/b'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
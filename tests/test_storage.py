@@ -0,0 +1,230 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from did_storage import (JSONFileStore, LogStore, SQLiteIdempotencyCache, SQLiteStore,
+                         UpdateConflict, VersionLog)
+from did_versions import rebuild, record_update
+
+
+def document_entry(did, version, name):
+    entry = {'did_document': {'id': did, 'name': name}, 'created': 0}
+    if version > 1:
+        entry['version'] = version
+    return entry
+
+
+class SQLiteStoreUpdateTest(unittest.TestCase):
+    """Dos instancias sobre la misma base, como dos workers de `serve`."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, 'registry.sqlite3')
+        self.stores = [SQLiteStore(path), SQLiteStore(path)]
+        for store in self.stores:
+            store.load()
+        self.did = 'did:example:1'
+        self.stores[0].put(self.did, document_entry(self.did, 1, 'v1'))
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.dir.cleanup()
+
+    def test_stale_update_conflicts(self):
+        first, second = self.stores
+        # Ambas leen la versión 1 y calculan la versión 2
+        self.assertEqual(first.get(self.did)['did_document']['name'], 'v1')
+        self.assertEqual(second.get(self.did)['did_document']['name'], 'v1')
+        first.update(self.did, document_entry(self.did, 2, 'first'), [])
+        with self.assertRaises(UpdateConflict):
+            second.update(self.did, document_entry(self.did, 2, 'second'), [])
+        self.assertEqual(second.get(self.did)['did_document']['name'], 'first')
+        self.assertEqual(first.get(self.did)['version'], 2)
+
+    def test_concurrent_updates_are_not_lost(self):
+        updates = 25
+
+        def worker(store, label):
+            for i in range(updates):
+                while True:
+                    entry = store.get(self.did)
+                    version = entry.get('version', 1) + 1
+                    try:
+                        store.update(self.did, document_entry(self.did, version, f'{label}{i}'), [])
+                    except UpdateConflict:
+                        continue
+                    break
+
+        threads = [threading.Thread(target=worker, args=(store, label))
+                   for store, label in zip(self.stores, 'ab')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.stores[0].get(self.did)['version'], 1 + 2 * updates)
+
+    def test_reads_share_a_bounded_pool(self):
+        store = SQLiteStore(os.path.join(self.dir.name, 'registry.sqlite3'), readers=2)
+        store.load()
+        threads = [threading.Thread(target=lambda: [store.get(self.did) for _ in range(20)])
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        opened = [conn for conn in store._readers.queue if conn is not None]
+        self.assertEqual(store._readers.qsize(), 2)
+        self.assertLessEqual(len(opened), 2)
+        self.assertEqual(store.get(self.did)['did_document']['name'], 'v1')
+        store.close()
+
+
+class VersionHistoryTest(unittest.TestCase):
+    """El historial se guarda fuera de la entrada y sobrevive al reabrir."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.did = 'did:example:1'
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def open_stores(self):
+        path = self.dir.name
+        return [SQLiteStore(os.path.join(path, 'registry.sqlite3')),
+                LogStore(os.path.join(path, 'registry.snapshot'),
+                         os.path.join(path, 'registry.log'),
+                         versions_path=os.path.join(path, 'registry.versions'))]
+
+    def test_versions_are_stored_out_of_line(self):
+        documents = [{'id': self.did, 'name': f'v{i}'} for i in range(1, 6)]
+        for store in self.open_stores():
+            store.load()
+            entry = {'did_document': documents[0], 'created': 0}
+            store.put(self.did, entry)
+            for document in documents[1:]:
+                entry, versions = record_update(entry, document, 3)
+                store.update(self.did, entry, [], versions)
+            self.assertNotIn('history', store.get(self.did))
+            store.close()
+        for store in self.open_stores():
+            store.load()
+            rebuilt = [rebuild(store.version_records(self.did, version), None)
+                       for version in range(1, 6)]
+            self.assertEqual(rebuilt, documents)
+            # La versión 4 es un checkpoint: no hace falta nada anterior
+            self.assertEqual(len(store.version_records(self.did, 5)), 2)
+            store.close()
+
+    def test_type_changes_are_recorded(self):
+        # En Python 1 == True == 1.0, pero en JSON son valores distintos
+        documents = [{'id': self.did, 'n': 1}, {'id': self.did, 'n': True},
+                     {'id': self.did, 'n': 1.0}]
+        entry = {'did_document': documents[0], 'created': 0}
+        records = []
+        for document in documents[1:]:
+            entry, versions = record_update(entry, document, 10)
+            records.extend(record for _, record in versions)
+        rebuilt = [rebuild(records[:version], None) for version in range(1, 4)]
+        self.assertEqual([type(document['n']) for document in rebuilt], [int, bool, float])
+
+    def test_version_log_keeps_only_offsets(self):
+        path = os.path.join(self.dir.name, 'registry.versions')
+        log = VersionLog(path)
+        entry = {'did_document': {'id': self.did, 'name': 'v1'}, 'created': 0}
+        for i in range(2, 5):
+            entry, versions = record_update(entry, {'id': self.did, 'name': f'v{i}'}, 2)
+            log.add(self.did, versions)
+        log.write(durable=False)
+        log.close()
+        log = VersionLog(path)
+        log.load()
+        self.assertTrue(all(isinstance(location, tuple) for *_, location in log.index[self.did]))
+        self.assertEqual(rebuild(log.since_checkpoint(self.did, 4), None)['name'], 'v4')
+        log.close()
+
+
+class JSONFileStoreChangesTest(unittest.TestCase):
+    """La numeración de cambios continúa tras reabrir el archivo."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'registry.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_sequence_survives_restart(self):
+        store = JSONFileStore(self.path)
+        store.load()
+        store.put('did:example:1', document_entry('did:example:1', 1, 'a'))
+        store.put('did:example:2', document_entry('did:example:2', 1, 'b'))
+        store.close()
+        store = JSONFileStore(self.path)
+        store.load()
+        self.assertEqual(store.last_change(), 2)
+        self.assertEqual(store.put('did:example:1', document_entry('did:example:1', 2, 'c')), 3)
+        # Los cambios anteriores al reinicio ya no se pueden listar
+        self.assertIsNone(store.changes_since(1))
+        self.assertEqual(store.changes_since(2), [(3, 'did:example:1')])
+        store.close()
+
+
+class SQLiteIdempotencyCacheTest(unittest.TestCase):
+    """Dos workers reservan la misma clave en la base compartida."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'registry.sqlite3')
+        # Los workers heredan del padre la misma clave de cifrado
+        key = os.urandom(32)
+        self.caches = [SQLiteIdempotencyCache(self.path, 100, 60, 60, key) for _ in range(2)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_one_owner_and_shared_response(self):
+        first, second = self.caches
+        slot, owner = first.claim('key', 'a')
+        self.assertTrue(owner)
+        waiting, owner = second.claim('key', 'a')
+        self.assertFalse(owner)
+        self.assertFalse(waiting.wait(0))
+        first.complete(slot, ({'DID': 'did:example:1'}, 201, {'X-DID-Seq': '1'}))
+        self.assertTrue(waiting.wait(1))
+        self.assertEqual(waiting.response, ({'DID': 'did:example:1'}, 201, {'X-DID-Seq': '1'}))
+        self.assertEqual(second.claim('key', 'b')[0].fingerprint, 'a')
+
+    def test_released_key_can_be_claimed_again(self):
+        first, second = self.caches
+        slot, _ = first.claim('key', 'a')
+        waiting, _ = second.claim('key', 'a')
+        first.release(slot)
+        self.assertTrue(waiting.wait(1))
+        self.assertIsNone(waiting.response)
+        self.assertTrue(second.claim('key', 'a')[1])
+
+    def test_response_is_encrypted(self):
+        first, _ = self.caches
+        slot, _ = first.claim('key', 'a')
+        first.complete(slot, ({'PrivateKey': 'secret'}, 201, {}))
+        with sqlite3.connect(self.path) as conn:
+            stored = conn.execute('SELECT response FROM idempotency_keys').fetchone()[0]
+        self.assertNotIn(b'secret', stored)
+        # Una ejecución nueva del servidor tiene otra clave y descarta las filas
+        SQLiteIdempotencyCache(self.path, 100, 60, 60)
+        self.assertEqual(first.stats()['size'], 0)
+
+    def test_expired_row_is_deleted_when_read(self):
+        first, second = self.caches
+        first.lease = 0
+        first.claim('key', 'a')
+        self.assertIsNone(second.row('key'))
+        self.assertEqual(second.stats()['size'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()